@@ -1,5 +1,8 @@
 import re
 
+# One action call; quoted parameter values may contain parentheses
+_ACTION_CALL_PATTERN = re.compile(r"\w+\((?:[^()']|'[^']*')*\)")
+
 def _parse_action_string(action_str):
     """
     Parses a single action string like "click(start_box='(x,y)')" into a dictionary.
@@ -65,4 +68,28 @@ def parse_action(model_output: str):
             elif "call_user()" in action_str:
                 action_data = {"action": "call_user", "params": {}}
 
-    return thought, action_data 
\ No newline at end of file
+    return thought, action_data
+
+def parse_actions(model_output: str, max_actions=None):
+    """
+    Parses model output that may contain several actions after "Action:", one per line.
+    Returns a tuple (thought, [action_data, ...]) in the order the actions should run.
+    """
+    thought, first_action = parse_action(model_output)
+
+    actions = []
+    action_match = re.search(r'Action:(.*)', model_output, re.DOTALL)
+    if action_match:
+        action_str = action_match.group(1).strip()
+        if action_str.startswith("```") and action_str.endswith("```"):
+            action_str = action_str[3:-3].strip()
+        for call_match in _ACTION_CALL_PATTERN.finditer(action_str):
+            action_data = _parse_action_string(call_match.group(0))
+            if action_data:
+                actions.append(action_data)
+
+    if not actions and first_action:
+        actions = [first_action]
+    if max_actions is not None:
+        actions = actions[:max_actions]
+    return thought, actions
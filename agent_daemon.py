@@ -0,0 +1,410 @@
+"""
+Long-lived desktop agent service with a local job queue API.
+
+The daemon keeps the model client, the desktop controller and its imports warm
+and runs submitted instruction files one job at a time, highest priority first.
+
+Usage:
+  python agent_daemon.py [--host 127.0.0.1] [--port 8765]
+  python agent_daemon.py --socket /tmp/desktop_agent.sock
+
+API:
+  POST /jobs               Submit a job. JSON body:
+                           {"instructions_file": "...", "otp": "...", "mobile": "...", "priority": 0,
+                            "plan_mode": false, "max_plan_actions": 3, "image_formats": "PNG,WEBP"}
+  GET  /jobs               List all jobs
+  GET  /jobs/<id>          Job status and, once done, its result
+  GET  /jobs/<id>/events   Stream per-step events as JSON lines until the job is done
+  DELETE /jobs/<id>        Cancel a queued or running job, or forget a finished one
+
+Job exit codes match run_agent_loop.py (0 success, 1 user intervention,
+2 agent error or timeout, 3 authentication required, 130 cancelled).
+
+Only the most recent finished jobs are kept (--max-finished-jobs), and a
+job's OTP and mobile values are only redacted from logs while it exists.
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import queue
+import signal
+import socketserver
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import agent_logging
+import desktop_controller
+import image_encoding
+from desktop_agent_core import DEFAULT_MAX_HISTORY_BYTES, DesktopAgent
+from run_agent_loop import load_instructions
+from run_with_arguments import create_session_dir, run_instruction
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """A submitted instruction file and everything recorded while running it."""
+
+    def __init__(self, instructions, instructions_file, priority, plan_mode=False, secrets=(), max_plan_actions=3,
+                 image_formats=image_encoding.DEFAULT_FORMATS):
+        self.id = uuid.uuid4().hex
+        self.plan_mode = plan_mode
+        self.max_plan_actions = max_plan_actions
+        self.image_formats = tuple(image_formats)
+        self.instructions = instructions
+        self.instructions_file = instructions_file
+        self.priority = priority
+        self.status = "queued"
+        self.exit_code = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.blocks = []
+        self.events = []
+        self.secrets = [value for value in secrets if value]
+        self.cancel_requested = False
+
+    def to_dict(self):
+        steps = sum(block["steps"] for block in self.blocks)
+        timings = {}
+        if self.started_at:
+            timings["queued_s"] = round(self.started_at - self.submitted_at, 3)
+        if self.finished_at:
+            timings["run_s"] = round(self.finished_at - self.started_at, 3)
+        artifacts = []
+        for block in self.blocks:
+            session_dir = block["session_dir"]
+            if os.path.isdir(session_dir):
+                artifacts.extend(os.path.join(session_dir, name) for name in sorted(os.listdir(session_dir)))
+        return {
+            "id": self.id,
+            "instructions_file": self.instructions_file,
+            "priority": self.priority,
+            "plan_mode": self.plan_mode,
+            "max_plan_actions": self.max_plan_actions,
+            "image_formats": ",".join(self.image_formats),
+            "status": self.status,
+            "exit_code": self.exit_code,
+            "steps": steps,
+            "timings": timings,
+            "blocks": self.blocks,
+            "artifacts": artifacts,
+        }
+
+
+class AgentDaemon:
+    """Owns the job queue and the single worker thread that drives the desktop."""
+
+    def __init__(self, ready_timeout=10.0, max_pixels=None, max_finished_jobs=100, max_job_seconds=3600.0,
+                 max_history_bytes=DEFAULT_MAX_HISTORY_BYTES, trace_memory=False):
+        self.ready_timeout = ready_timeout
+        self.max_pixels = max_pixels
+        self.max_history_bytes = max_history_bytes
+        self.trace_memory = trace_memory
+        self.max_finished_jobs = max_finished_jobs
+        self.max_job_seconds = max_job_seconds
+        self.jobs = {}  # Insertion ordered, so the oldest finished jobs are evicted first
+        self.queue = queue.PriorityQueue()
+        self.changed = threading.Condition()
+        self._sequence = itertools.count()
+        self._agent = None
+        self._http = requests.Session()
+        self._worker = threading.Thread(target=self._run_worker, daemon=True)
+
+    def start(self):
+        # Load the desktop backend up front so the first job does not pay for it
+        if not desktop_controller.wait_for_display_ready(timeout=self.ready_timeout):
+            logger.warning("Display is not ready yet; jobs will check again before running.")
+        self._worker.start()
+
+    def submit(self, instructions_file, otp=None, mobile=None, priority=0, plan_mode=False, max_plan_actions=3,
+               image_formats=image_encoding.DEFAULT_FORMATS):
+        """Validates and queues a job. Raises ValueError if the instructions cannot be loaded."""
+        try:
+            instructions = load_instructions(instructions_file, otp, mobile)
+        except Exception:
+            # Anything registered for this job must not stay masked in every later record
+            self._release_secrets([otp, mobile])
+            raise
+        job = Job(instructions, instructions_file, priority, plan_mode, secrets=[otp, mobile],
+                  max_plan_actions=max_plan_actions, image_formats=image_formats)
+        with self.changed:
+            self.jobs[job.id] = job
+        # Higher priority first, then submission order
+        self.queue.put((-priority, next(self._sequence), job.id))
+        logger.info(f"Queued job {job.id} ({len(instructions)} instruction blocks, priority {priority})")
+        return job
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued job, asks a running one to stop after its current step, or forgets a
+        finished one. Returns the job, or None if it is unknown.
+        """
+        with self.changed:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == "queued":
+                # The worker skips it when it comes off the queue
+                job.exit_code = 130
+                self._finish(job)
+            elif job.status == "running":
+                job.cancel_requested = True
+            else:
+                del self.jobs[job_id]
+        return job
+
+    def _release_secrets(self, secrets):
+        for value in secrets:
+            agent_logging.remove_secret(value)
+
+    def _finish(self, job):
+        """Marks a job done and evicts the oldest finished jobs beyond the retention limit. Call with self.changed held."""
+        job.status = "done"
+        job.finished_at = time.time()
+        job.events.append({"event": "job_done", "exit_code": job.exit_code, "time": job.finished_at})
+        self._release_secrets(job.secrets)
+        job.secrets = []
+        finished = [other.id for other in self.jobs.values() if other.status == "done"]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
+        self.changed.notify_all()
+
+    def _record(self, job, event):
+        with self.changed:
+            event["time"] = time.time()
+            job.events.append(event)
+            self.changed.notify_all()
+
+    def _get_agent(self, session_dir, job):
+        if self._agent is None:
+            self._agent = DesktopAgent(session_dir=session_dir, http_session=self._http,
+                                       max_history_bytes=self.max_history_bytes, trace_memory=self.trace_memory)
+            if self.max_pixels:
+                self._agent.image_max_pixels = self.max_pixels
+        else:
+            self._agent.reset(session_dir)
+        self._agent.plan_mode = job.plan_mode
+        self._agent.max_plan_actions = job.max_plan_actions
+        self._agent.image_formats = job.image_formats
+        return self._agent
+
+    def _run_worker(self):
+        while True:
+            _, _, job_id = self.queue.get()
+            with self.changed:
+                job = self.jobs.get(job_id)
+                if job is None or job.status != "queued":
+                    # Cancelled while queued
+                    self.queue.task_done()
+                    continue
+                job.status = "running"
+            try:
+                self._run_job(job)
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {e}")
+                job.exit_code = 2
+            finally:
+                with self.changed:
+                    self._finish(job)
+                self.queue.task_done()
+
+    def _run_job(self, job):
+        job.started_at = time.time()
+        deadline = time.monotonic() + self.max_job_seconds if self.max_job_seconds else None
+        self._record(job, {"event": "job_started"})
+
+        if not desktop_controller.wait_for_display_ready(timeout=self.ready_timeout):
+            job.exit_code = 2
+            return
+
+        job.exit_code = 0
+        for idx, instr in enumerate(job.instructions, start=1):
+            session_dir = create_session_dir(job.id)
+            block = {"index": idx, "session_dir": session_dir, "exit_code": None, "steps": 0, "duration_s": None}
+            job.blocks.append(block)
+            self._record(job, {"event": "block_started", "block": idx, "session_dir": session_dir})
+
+            def on_step(step_number, status, elapsed, block=block):
+                block["steps"] = step_number
+                self._record(job, {"event": "step", "block": block["index"], "step": step_number,
+                                   "status": status, "elapsed_s": round(elapsed, 3)})
+
+            agent_logging.open_session_log(session_dir)
+            block_started = time.perf_counter()
+            try:
+                logger.info(f"Session data will be saved in: {session_dir}")
+                exit_code = run_instruction(self._get_agent(session_dir, job), instr, on_step=on_step,
+                                            deadline=deadline, should_stop=lambda: job.cancel_requested)
+            finally:
+                agent_logging.close_session_log()
+
+            block["exit_code"] = exit_code
+            block["duration_s"] = round(time.perf_counter() - block_started, 3)
+            self._record(job, {"event": "block_done", "block": idx, "exit_code": exit_code})
+
+            if exit_code != 0:
+                # Same behaviour as run_agent_loop.py: stop at the first block that does not succeed
+                job.exit_code = exit_code
+                break
+
+
+class _JobRequestHandler(BaseHTTPRequestHandler):
+    agent_daemon = None  # Set by make_server
+
+    def _send_json(self, code, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            self._send_json(404, {"error": "Not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            instructions_file = body["instructions_file"]
+            for field in ("otp", "mobile"):
+                if not isinstance(body.get(field), (str, type(None))):
+                    raise ValueError(f"Field '{field}' must be a string")
+            max_plan_actions = int(body.get("max_plan_actions", 3))
+            if max_plan_actions < 1:
+                raise ValueError("Field 'max_plan_actions' must be at least 1")
+            image_formats = body.get("image_formats", ",".join(image_encoding.DEFAULT_FORMATS))
+            if not isinstance(image_formats, str):
+                raise ValueError("Field 'image_formats' must be a comma-separated string")
+            try:
+                image_formats = image_encoding.formats_arg(image_formats)
+            except argparse.ArgumentTypeError as e:
+                raise ValueError(f"Field 'image_formats': {e}")
+            job = self.agent_daemon.submit(instructions_file, body.get("otp"), body.get("mobile"),
+                                     int(body.get("priority", 0)), bool(body.get("plan_mode", False)),
+                                     max_plan_actions, image_formats)
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": str(e) if not isinstance(e, KeyError) else f"Missing field: {e}"})
+            return
+        self._send_json(202, {"id": job.id, "status": job.status})
+
+    def do_DELETE(self):
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+        if len(parts) != 2 or parts[0] != "jobs":
+            self._send_json(404, {"error": "Not found"})
+            return
+        job = self.agent_daemon.cancel(parts[1])
+        if job is None:
+            self._send_json(404, {"error": f"Unknown job: {parts[1]}"})
+            return
+        status = "cancelling" if job.cancel_requested and job.status == "running" else job.status
+        self._send_json(200, {"id": job.id, "status": status})
+
+    def do_GET(self):
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+        if parts == ["jobs"]:
+            with self.agent_daemon.changed:
+                jobs = [job.to_dict() for job in self.agent_daemon.jobs.values()]
+            self._send_json(200, jobs)
+            return
+        if len(parts) in (2, 3) and parts[0] == "jobs":
+            job = self.agent_daemon.jobs.get(parts[1])
+            if job is None:
+                self._send_json(404, {"error": f"Unknown job: {parts[1]}"})
+                return
+            if len(parts) == 2:
+                with self.agent_daemon.changed:
+                    self._send_json(200, job.to_dict())
+                return
+            if parts[2] == "events":
+                self._stream_events(job)
+                return
+        self._send_json(404, {"error": "Not found"})
+
+    def _stream_events(self, job):
+        """Writes job events as JSON lines, blocking until the job is done."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        sent = 0
+        while True:
+            with self.agent_daemon.changed:
+                self.agent_daemon.changed.wait_for(lambda: len(job.events) > sent or job.status == "done", timeout=30)
+                pending = job.events[sent:]
+                done = job.status == "done"
+            for event in pending:
+                self.wfile.write((json.dumps(event) + "\n").encode("utf-8"))
+            self.wfile.flush()
+            sent += len(pending)
+            if done and sent == len(job.events):
+                return
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(daemon, host="127.0.0.1", port=8765, socket_path=None):
+    """Creates the HTTP server for the job API on a TCP port or a Unix socket."""
+    handler = type("JobRequestHandler", (_JobRequestHandler,), {"agent_daemon": daemon})
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return _UnixHTTPServer(socket_path, handler)
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the desktop agent as a long-lived service with a local job queue.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765)")
+    parser.add_argument("--socket", help="Listen on this Unix socket path instead of a TCP port")
+    parser.add_argument("--ready-timeout", type=float, default=10.0, help="Seconds to wait for the display to become ready (default: 10)")
+    parser.add_argument("--max-pixels", type=image_encoding.max_pixels_arg, default=None, help="Pixel budget for screenshots sent to the model")
+    parser.add_argument("--max-history-mb", type=float, default=DEFAULT_MAX_HISTORY_BYTES / (1024 * 1024),
+                        help="Screenshot bytes kept in the model conversation, in MB (default: %(default)s)")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Trace allocations and add a memory report to each step in steps.jsonl")
+    parser.add_argument("--max-finished-jobs", type=int, default=100, help="Finished jobs kept for GET /jobs (default: 100)")
+    parser.add_argument("--max-job-seconds", type=float, default=3600.0, help="Time limit per job, 0 for none (default: 3600)")
+    parser.add_argument("--log-level", default=None, help="Log level, e.g. DEBUG or INFO (default: $AGENT_LOG_LEVEL or INFO)")
+    args = parser.parse_args()
+    agent_logging.configure(args.log_level)
+
+    daemon = AgentDaemon(ready_timeout=args.ready_timeout, max_pixels=args.max_pixels,
+                         max_finished_jobs=args.max_finished_jobs, max_job_seconds=args.max_job_seconds,
+                         max_history_bytes=int(args.max_history_mb * 1024 * 1024), trace_memory=args.trace_memory)
+    server = make_server(daemon, args.host, args.port, args.socket)
+
+    def shutdown(signal_received=None, frame=None):
+        logger.info("Shutting down agent daemon.")
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    daemon.start()
+    logger.info(f"Agent daemon listening on {args.socket or f'http://{args.host}:{args.port}'}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Structured logging for the desktop agent.
+
+Log calls only put records on a queue; a background listener thread writes
+them to the console and to a JSON lines file in the current session directory.
+Before a record leaves the calling thread it is stamped with the session and
+step IDs, base64 images are replaced by a size marker, registered secrets such
+as OTP and mobile values are masked, and very long messages are truncated.
+
+The level defaults to INFO and can be changed with --log-level or the
+AGENT_LOG_LEVEL environment variable. Values listed (one per line) in
+AGENT_LOG_REDACT are masked in every record, which lets a parent process pass
+its secrets on to child processes.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import threading
+import time
+
+SESSION_LOG_NAME = "session_log.jsonl"
+MAX_MESSAGE_CHARS = 4000
+LEVEL_ENV = "AGENT_LOG_LEVEL"
+REDACT_ENV = "AGENT_LOG_REDACT"
+
+_DATA_URL_PATTERN = re.compile(r"data:image/[\w.+-]+;base64,[A-Za-z0-9+/=]+")
+_BASE64_PATTERN = re.compile(r"[A-Za-z0-9+/]{512,}={0,2}")
+
+_context = threading.local()
+# Reference counts per secret; _secrets is an immutable snapshot, longest first, so
+# redact() can read it from any thread without a lock
+_secret_counts = {}
+_secrets = ()
+_secrets_lock = threading.Lock()
+_listener = None
+_queue_handler = None
+
+
+def add_secret(value):
+    """Masks value in every log record until a matching remove_secret call."""
+    global _secrets
+    if not value:
+        return
+    with _secrets_lock:
+        value = str(value)
+        _secret_counts[value] = _secret_counts.get(value, 0) + 1
+        _secrets = tuple(sorted(_secret_counts, key=len, reverse=True))
+
+
+def remove_secret(value):
+    """Undoes one add_secret call; the value is unmasked once every caller has removed it."""
+    global _secrets
+    if not value:
+        return
+    with _secrets_lock:
+        value = str(value)
+        count = _secret_counts.get(value, 0) - 1
+        if count > 0:
+            _secret_counts[value] = count
+        else:
+            _secret_counts.pop(value, None)
+        _secrets = tuple(sorted(_secret_counts, key=len, reverse=True))
+
+
+def secrets_for_env():
+    """Registered secrets in the form expected by AGENT_LOG_REDACT."""
+    return "\n".join(sorted(_secrets))
+
+
+def set_context(**values):
+    """Sets session_id and/or step for records logged from the current thread."""
+    for key, value in values.items():
+        setattr(_context, key, value)
+
+
+def mask_secrets(text):
+    """Replaces every registered secret in text with ***."""
+    for secret in _secrets:
+        text = text.replace(secret, "***")
+    return text
+
+
+def redact(text):
+    """Removes base64 images and secrets from text and truncates it to MAX_MESSAGE_CHARS."""
+    text = _DATA_URL_PATTERN.sub(lambda m: f"<image {len(m.group(0))} chars>", text)
+    text = _BASE64_PATTERN.sub(lambda m: f"<base64 {len(m.group(0))} chars>", text)
+    text = mask_secrets(text)
+    if len(text) > MAX_MESSAGE_CHARS:
+        text = f"{text[:MAX_MESSAGE_CHARS]}... <{len(text) - MAX_MESSAGE_CHARS} chars truncated>"
+    return text
+
+
+class _ContextFilter(logging.Filter):
+    """Runs in the calling thread: stamps IDs and redacts before the record is queued."""
+
+    def filter(self, record):
+        record.msg = redact(record.getMessage())
+        record.args = None
+        if record.exc_info:
+            record.exc_text = redact(logging.Formatter().formatException(record.exc_info))
+            record.exc_info = None
+        record.session_id = getattr(_context, "session_id", None)
+        record.step = getattr(_context, "step", None)
+        record.session_log = getattr(_context, "session_log", None)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "session_id": getattr(record, "session_id", None),
+            "step": getattr(record, "step", None),
+            "message": record.getMessage(),
+        }
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _ConsoleFilter(logging.Filter):
+    def filter(self, record):
+        return not (getattr(record, "close_session_log", False) or getattr(record, "flush_event", None))
+
+
+class _SessionFileHandler(logging.Handler):
+    """Runs on the listener thread and writes each record to the log of the session it came from."""
+
+    def __init__(self):
+        super().__init__()
+        self.files = {}
+        self.setFormatter(JsonFormatter())
+
+    def emit(self, record):
+        flush_event = getattr(record, "flush_event", None)
+        if flush_event is not None:
+            for log_file in self.files.values():
+                log_file.flush()
+            flush_event.set()
+            return
+        path = getattr(record, "session_log", None)
+        if path is None:
+            return
+        try:
+            log_file = self.files.get(path)
+            if log_file is None:
+                log_file = self.files[path] = open(path, "a", encoding="utf-8")
+            log_file.write(self.format(record) + "\n")
+            if getattr(record, "close_session_log", False):
+                self.files.pop(path).close()
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        for log_file in self.files.values():
+            log_file.close()
+        self.files.clear()
+        super().close()
+
+
+def _log_uncaught(exc_type, exc_value, exc_traceback):
+    """sys.excepthook: logs uncaught exceptions (redacted, and into the session log if one is open)."""
+    if issubclass(exc_type, KeyboardInterrupt):
+        sys.__excepthook__(exc_type, exc_value, exc_traceback)
+        return
+    logging.getLogger(__name__).critical("Unhandled exception", exc_info=(exc_type, exc_value, exc_traceback))
+    flush()
+
+
+def _log_uncaught_in_thread(args):
+    if args.exc_type is SystemExit:
+        return
+    logging.getLogger(__name__).critical(f"Unhandled exception in thread {args.thread.name if args.thread else '?'}",
+                                         exc_info=(args.exc_type, args.exc_value, args.exc_traceback))
+
+
+def configure(level=None, console=True):
+    """
+    Sets up queue-based logging for the process. Safe to call more than once;
+    later calls only change the level. Python warnings and uncaught exceptions
+    are logged too, so they reach the session log instead of only stderr.
+    """
+    global _listener, _queue_handler
+    level = (level or os.environ.get(LEVEL_ENV) or "INFO").upper()
+    root = logging.getLogger()
+    root.setLevel(level)
+
+    for value in os.environ.get(REDACT_ENV, "").split("\n"):
+        add_secret(value)
+
+    if _listener is not None:
+        return
+
+    handlers = []
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter("%(message)s"))
+        console_handler.addFilter(_ConsoleFilter())
+        handlers.append(console_handler)
+    # Last, so a flush marker is only acknowledged once the console has written everything before it
+    handlers.append(_SessionFileHandler())
+
+    log_queue = queue.SimpleQueue()
+    _queue_handler = logging.handlers.QueueHandler(log_queue)
+    _queue_handler.addFilter(_ContextFilter())
+    root.addHandler(_queue_handler)
+    _listener = logging.handlers.QueueListener(log_queue, *handlers)
+    _listener.start()
+    logging.captureWarnings(True)
+    sys.excepthook = _log_uncaught
+    threading.excepthook = _log_uncaught_in_thread
+    atexit.register(shutdown)
+
+
+def open_session_log(session_dir, session_id=None):
+    """Routes records from the current thread to a JSON lines file in session_dir and returns its path."""
+    path = os.path.join(session_dir, SESSION_LOG_NAME)
+    set_context(session_id=session_id or os.path.basename(os.path.normpath(session_dir)), step=None, session_log=path)
+    return path
+
+
+def close_session_log():
+    """Stops routing records from the current thread to its session file and closes the file."""
+    if _queue_handler is not None:
+        # Handed straight to the queue so the marker is not dropped by the level setting
+        record = logging.LogRecord(__name__, logging.INFO, __file__, 0, "Session log closed", None, None)
+        record.close_session_log = True
+        _queue_handler.handle(record)
+    set_context(session_id=None, step=None, session_log=None)
+
+
+def flush(timeout=2.0):
+    """Blocks until records logged so far have been written, or the timeout expires."""
+    if _queue_handler is None:
+        return
+    record = logging.LogRecord(__name__, logging.INFO, __file__, 0, "flush", None, None)
+    record.flush_event = threading.Event()
+    _queue_handler.handle(record)
+    record.flush_event.wait(timeout)
+
+
+def shutdown():
+    """Drains the queue and closes all log files."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        logging.getLogger().removeHandler(_queue_handler)
+        _listener = None
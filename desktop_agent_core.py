@@ -1,14 +1,42 @@
-import requests
 import base64
+import hashlib
+import json
+import logging
+import os
+import time
+import tracemalloc
 from prompts import get_simple_system_prompt, get_detailed_user_prompt
-from action_parser import parse_action
+from action_parser import parse_action, parse_actions
+from loop_detector import LoopDetector
 import desktop_controller
+import image_encoding
+import step_log
+
+logger = logging.getLogger(__name__)
+
+API_URL = "http://10.0.0.6:8000/v1/chat/completions"
+
+# Upper bound on the base64 screenshot bytes kept in the conversation history.
+# Once it is exceeded the oldest screenshots are dropped first; the model's own
+# Thought/Action replies are always kept so it knows what it has already done.
+DEFAULT_MAX_HISTORY_BYTES = 16 * 1024 * 1024
+OMITTED_SCREENSHOT_TEXT = "(Earlier screenshot omitted.)"
 
 
 class DesktopAgent:
-    def __init__(self, session_dir, max_same_action=5, max_wait=5, max_total_steps=30):
+    def __init__(self, session_dir, max_same_action=5, max_wait=5, max_total_steps=30,
+                 api_url=API_URL, max_history_bytes=DEFAULT_MAX_HISTORY_BYTES, trace_memory=False,
+                 http_session=None, max_action_frequency=15, loop_detector=None,
+                 plan_mode=False, max_plan_actions=3, plan_settle_delay=0.5, plan_max_changed_tiles=4,
+                 image_max_pixels=image_encoding.DEFAULT_MAX_PIXELS, image_formats=image_encoding.DEFAULT_FORMATS,
+                 record_steps=True):
         self.session_dir = session_dir
+        self.api_url = api_url
+        self.http = http_session  # A requests.Session keeps the model connection alive
         self.history = []
+        self.history_bytes = 0
+        self.history_images = 0  # Turns at the end of the history that still carry their screenshot
+        self.max_history_bytes = max_history_bytes
         self.max_same_action = max_same_action
         self.max_wait = max_wait
         self.max_total_steps = max_total_steps
@@ -19,14 +47,114 @@ class DesktopAgent:
         self.last_model_action = None
         self.last_action_params = None
         self.action_type_counter = {}  # Track frequency of action types
+        self.max_action_frequency = max_action_frequency
+        self.loop_detector = loop_detector or LoopDetector()
+        # Plan mode lets the model return several actions per call (e.g. click field, type, Enter)
+        self.plan_mode = plan_mode
+        self.max_plan_actions = max_plan_actions
+        self.plan_settle_delay = plan_settle_delay
+        self.plan_max_changed_tiles = plan_max_changed_tiles
+        # Screenshots are resized to this pixel budget on the model's patch grid
+        self.image_max_pixels = image_max_pixels
+        self.image_formats = image_formats
+        self.coord_scale = None
+        # Each step is appended to steps.jsonl in the session directory so it can be replayed
+        self.record_steps = record_steps
+        self.step_number = 0
+        self.last_step = {}
+        self._encode_buffer = bytearray()  # Reused across screenshots to avoid a fresh allocation per read
+        self.trace_memory = trace_memory
+        self.last_memory_report = None
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def reset(self, session_dir=None):
+        """
+        Clears history and loop-detection state so the same agent can run another instruction.
+        """
+        if session_dir is not None:
+            self.session_dir = session_dir
+        self.history.clear()
+        self.history_bytes = 0
+        self.history_images = 0
+        self.wait_counter = 0
+        self.same_action_counter = 0
+        self.total_steps = 0
+        self.last_model_output = None
+        self.last_model_action = None
+        self.last_action_params = None
+        self.action_type_counter.clear()
+        self.loop_detector.reset()
+        self.step_number = 0
+        self.last_step = {}
+        self.last_memory_report = None
+
+    def settings(self):
+        """
+        The limits and plan settings that decide how a model output is handled, with the
+        loop detector's own settings, so a recorded step can be replayed by an equivalent agent.
+        """
+        return {
+            "max_same_action": self.max_same_action,
+            "max_wait": self.max_wait,
+            "max_total_steps": self.max_total_steps,
+            "max_action_frequency": self.max_action_frequency,
+            "plan_mode": self.plan_mode,
+            "max_plan_actions": self.max_plan_actions,
+            "plan_max_changed_tiles": self.plan_max_changed_tiles,
+            "loop_detector": self.loop_detector.settings(),
+        }
 
     def _encode_image(self, image_path):
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+        """Base64-encodes an image file, reading it into a buffer that is reused between calls."""
+        size = os.path.getsize(image_path)
+        if len(self._encode_buffer) < size:
+            self._encode_buffer = bytearray(size)
+        view = memoryview(self._encode_buffer)[:size]
+        try:
+            with open(image_path, "rb") as image_file:
+                read = image_file.readinto(view)
+            return base64.b64encode(view[:read]).decode('utf-8')
+        finally:
+            view.release()
+
+    def _append_history(self, user_message, assistant_message, image_bytes):
+        """
+        Adds a turn to the history. Once the screenshot byte budget is exceeded, the oldest
+        turns lose their screenshot, which is replaced by a short text note; the assistant
+        replies stay.
+        """
+        self.history.append({"user": user_message, "assistant": assistant_message, "bytes": image_bytes})
+        self.history_bytes += image_bytes
+        self.history_images += 1
+        while self.history_images and self.history_bytes > self.max_history_bytes:
+            turn = self.history[len(self.history) - self.history_images]
+            turn["user"] = {"role": "user", "content": [{"type": "text", "text": OMITTED_SCREENSHOT_TEXT}]}
+            self.history_bytes -= turn["bytes"]
+            turn["bytes"] = 0
+            self.history_images -= 1
+
+    def memory_report(self):
+        """
+        Returns a dictionary describing the agent's current memory use.
+        Allocation figures are only available when tracemalloc is tracing.
+        """
+        report = {
+            "history_turns": len(self.history),
+            "history_images": self.history_images,
+            "history_bytes": self.history_bytes,
+            "encode_buffer_bytes": len(self._encode_buffer),
+        }
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            report["traced_current_bytes"] = current
+            report["traced_peak_bytes"] = peak
+        return report
 
     def _call_model(self, messages):
+        import requests
+
         try:
-            API_URL = "http://10.0.0.6:8000/v1/chat/completions"
             headers = {"Content-Type": "application/json"}
             
             payload = {
@@ -37,28 +165,30 @@ class DesktopAgent:
                 "stream": False
             }
             
-            response = requests.post(API_URL, json=payload, headers=headers, timeout=300)
+            response = (self.http or requests).post(self.api_url, json=payload, headers=headers, timeout=300)
             response.raise_for_status()
             model_output = response.json()["choices"][0]["message"]["content"]
             self.last_model_output = model_output
             return model_output
         
         except requests.exceptions.RequestException as e:
-            print(f"Error calling model API: {e}")
+            logger.error(f"Error calling model API: {e}")
             return "api_error"
         
-    def call_uitars_model(self, instruction, screenshot_path):
+    def call_uitars_model(self, instruction, screenshot_path, fingerprint=None):
         """
         Calls the UI-TARS model and returns the model output and the user message for history.
+        fingerprint is the screen_hash fingerprint of the screenshot, used for loop detection.
         """
-        print("\n--- [Step] Calling UI-TARS Model ---")
-        
-        with open(screenshot_path, "rb") as image_file:
-            encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
+        import requests
+
+        logger.info("--- [Step] Calling UI-TARS Model ---")
         
+        encoded_image = self._encode_image(screenshot_path)
+
         messages = [
-            {"role": "system", "content": get_simple_system_prompt()},
-            {"role": "user", "content": get_detailed_user_prompt(instruction)}
+            {"role": "system", "content": get_simple_system_prompt(self.plan_mode, self.max_plan_actions)},
+            {"role": "user", "content": get_detailed_user_prompt(instruction, self.plan_mode, self.max_plan_actions)}
         ]
 
         for turn in self.history:
@@ -68,7 +198,7 @@ class DesktopAgent:
         current_user_message = {
             "role": "user", 
             "content": [
-                {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{encoded_image}"}}
+                {"type": "image_url", "image_url": {"url": f"data:{image_encoding.mime_type_for_path(screenshot_path)};base64,{encoded_image}"}}
             ]
         }
         messages.append(current_user_message)
@@ -79,29 +209,80 @@ class DesktopAgent:
             "temperature": 0.0,
             "max_tokens": 4096,
         }
+        # Serialised once so the step log can record a digest of exactly what was sent
+        body = json.dumps(payload).encode("utf-8")
+        self.last_step["request_sha256"] = hashlib.sha256(body).hexdigest()
 
         try:
-            response = requests.post("http://10.0.0.6:8000/v1/chat/completions", json=payload, timeout=300)
+            started = time.perf_counter()
+            response = (self.http or requests).post(self.api_url, data=body,
+                                                    headers={"Content-Type": "application/json"}, timeout=300)
             response.raise_for_status()
-            print("Server response received.")
+            logger.debug("Server response received.")
             model_output = response.json()["choices"][0]["message"]["content"]
+            self.last_step["inference_ms"] = (time.perf_counter() - started) * 1000
+            self.last_step["model_output"] = model_output
+            logger.debug("Raw model output: %r", model_output)
             assistant_message = {"role": "assistant", "content": model_output}
-            self.history.append({"user": current_user_message, "assistant": assistant_message})
+            self._append_history(current_user_message, assistant_message, len(encoded_image))
 
-            return self.parse_and_execute(model_output)
+            started = time.perf_counter()
+            status = self.parse_and_execute(model_output, fingerprint)
+            self.last_step["execute_ms"] = (time.perf_counter() - started) * 1000
+            return status
         
         except requests.exceptions.RequestException as e:
-            print(f"Error calling UI-TARS model: {e}")
+            logger.error(f"Error calling UI-TARS model: {e}")
             return "api_error"
 
-    def parse_and_execute(self, model_output):
-        """Parses the model output and executes the action."""
-        thought, parsed_action_dict = parse_action(model_output)
-        if not parsed_action_dict:
-            print("Could not parse action from model output.")
+    def parse_and_execute(self, model_output, fingerprint=None):
+        """Parses the model output and executes the action, or each action of a plan in plan mode."""
+        if self.plan_mode:
+            thought, actions = parse_actions(model_output, self.max_plan_actions)
+        else:
+            thought, parsed_action_dict = parse_action(model_output)
+            actions = [parsed_action_dict] if parsed_action_dict else []
+        self.last_step["actions"] = actions
+        if not actions:
+            logger.warning("Could not parse action from model output.")
             return "parse_error"
-        print(f"Thought: {thought}")
-        print(f"Action: {parsed_action_dict}")
+        logger.info(f"Thought: {thought}")
+
+        if len(actions) == 1:
+            return self._execute_parsed_action(actions[0], fingerprint)
+        return self._execute_plan(actions, fingerprint)
+
+    def _execute_plan(self, actions, fingerprint):
+        """
+        Runs a multi-action plan in order. Before each action after the first, the screen is
+        checked against the one the plan was made on; if too much of it has changed the rest
+        of the plan is dropped so the model can be asked again with a fresh screenshot.
+        """
+        logger.info(f"Plan with {len(actions)} actions.")
+        step_fingerprint = fingerprint
+        status = "continue"
+        for index, action in enumerate(actions):
+            if index > 0:
+                step_fingerprint = desktop_controller.capture_fingerprint()
+                self.last_step.setdefault("plan_fingerprints", []).append(step_log.fingerprint_to_json(step_fingerprint))
+                if fingerprint is not None and step_fingerprint is not None:
+                    import screen_hash
+                    changed = screen_hash.changed_tiles(fingerprint, step_fingerprint)
+                    if len(changed) > self.plan_max_changed_tiles:
+                        logger.warning(f"Screen changed in {len(changed)} regions after action {index}; "
+                              f"dropping the remaining {len(actions) - index} planned actions.")
+                        return "continue"
+
+            is_last = index == len(actions) - 1
+            settle_delay = 2 if is_last else self.plan_settle_delay
+            status = self._execute_parsed_action(action, step_fingerprint, settle_delay)
+            if status != "continue":
+                return status
+        return status
+
+    def _execute_parsed_action(self, parsed_action_dict, fingerprint=None, settle_delay=2):
+        """Runs the terminal-action and loop checks for one parsed action, then executes it."""
+        logger.info(f"Action: {parsed_action_dict}")
 
         # Increment total step counter
         self.total_steps += 1
@@ -110,15 +291,15 @@ class DesktopAgent:
         action_name = parsed_action_dict.get("action")
         
         if action_name == "finished":
-            print("Task marked as finished by model.")
+            logger.info("Task marked as finished by model.")
             return "finished"
         
         if action_name == "authenticate":
-            print("Model requested user authentication (OTP/mobile number).")
+            logger.info("Model requested user authentication (OTP/mobile number).")
             return "authenticate"
         
         if action_name == "call_user":
-            print("Model requested user intervention.")
+            logger.info("Model requested user intervention.")
             return "call_user"
 
         # Track action type frequency for better loop detection
@@ -126,13 +307,12 @@ class DesktopAgent:
 
         # Check for excessive total steps (infinite loop detection)
         if self.total_steps >= self.max_total_steps:
-            print(f"Exceeded maximum total steps ({self.max_total_steps}). Agent may be stuck in infinite loop. Calling user.")
+            logger.warning(f"Exceeded maximum total steps ({self.max_total_steps}). Agent may be stuck in infinite loop. Calling user.")
             return "call_user"
 
         # Check for excessive action type frequency (even with different coordinates)
-        max_action_frequency = 15  # Allow up to 15 clicks, scrolls, etc. of same type
-        if self.action_type_counter[action_name] >= max_action_frequency:
-            print(f"Action type '{action_name}' has been used {self.action_type_counter[action_name]} times. Agent may be stuck. Calling user.")
+        if self.action_type_counter[action_name] >= self.max_action_frequency:
+            logger.warning(f"Action type '{action_name}' has been used {self.action_type_counter[action_name]} times. Agent may be stuck. Calling user.")
             return "call_user"
 
         # Track repeated identical actions with the same parameters
@@ -150,7 +330,13 @@ class DesktopAgent:
             self.last_action_params = current_params
 
         if self.same_action_counter >= self.max_same_action:
-            print(f"Action '{action_name}' with same parameters output by model {self.same_action_counter} times in a row. Calling user.")
+            logger.warning(f"Action '{action_name}' with same parameters output by model {self.same_action_counter} times in a row. Calling user.")
+            return "call_user"
+
+        # Check for cycles and no-progress streaks against the screen the action was chosen on
+        loop_reason = self.loop_detector.observe(fingerprint, parsed_action_dict)
+        if loop_reason:
+            logger.warning(f"Loop detected: {loop_reason}. Calling user.")
             return "call_user"
 
         if action_name == "wait":
@@ -159,20 +345,59 @@ class DesktopAgent:
             self.wait_counter = 0
 
         if self.wait_counter >= self.max_wait:
-            print(f"Exceeded {self.max_wait} consecutive waits, handing control back to user.")
+            logger.warning(f"Exceeded {self.max_wait} consecutive waits, handing control back to user.")
             return "call_user"
 
         # Execute action with exception guard
         try:
-            status = desktop_controller.execute_action(parsed_action_dict)
+            status = desktop_controller.execute_action(parsed_action_dict, settle_delay=settle_delay,
+                                                       coord_scale=self.coord_scale)
         except Exception as e:
-            print(f"Exception during action execution: {e}")
+            logger.error(f"Exception during action execution: {e}")
             return "api_error"
         return status
         
+    def _record_step(self, capture, capture_ms, status):
+        """Appends the step just taken to the session's steps.jsonl for offline replay."""
+        step = self.last_step
+        record = {
+            "step": self.step_number,
+            "frame": os.path.basename(capture.path),
+            "coord_scale": capture.coord_scale,
+            "fingerprint": step_log.fingerprint_to_json(capture.fingerprint),
+            "request_sha256": step.get("request_sha256"),
+            "model_output": step.get("model_output"),
+            "actions": step.get("actions", []),
+            "plan_fingerprints": step.get("plan_fingerprints", []),
+            "status": status,
+            "timings_ms": {
+                "capture": round(capture_ms, 2),
+                "inference": round(step.get("inference_ms", 0.0), 2),
+                "execute": round(step.get("execute_ms", 0.0), 2),
+            },
+            "settings": self.settings(),
+        }
+        if self.trace_memory:
+            record["memory"] = self.last_memory_report
+        try:
+            step_log.append_step(self.session_dir, record)
+        except OSError as e:
+            logger.warning(f"Could not write step log: {e}")
+
     def step(self, instruction):
         """Performs one step of the agent's loop."""
-        screenshot_path = desktop_controller.take_screenshot(self.session_dir)
-        status = self.call_uitars_model(instruction, screenshot_path)
+        self.step_number += 1
+        self.last_step = {}
+        started = time.perf_counter()
+        capture = desktop_controller.capture_screen(self.session_dir, self.image_max_pixels, self.image_formats,
+                                                   step=self.step_number)
+        capture_ms = (time.perf_counter() - started) * 1000
+        self.coord_scale = capture.coord_scale
+        status = self.call_uitars_model(instruction, capture.path, capture.fingerprint)
+        if self.trace_memory:
+            self.last_memory_report = self.memory_report()
+            logger.debug(f"Memory: {self.last_memory_report}")
+        if self.record_steps:
+            self._record_step(capture, capture_ms, status)
         return status
     
\ No newline at end of file
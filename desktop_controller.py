@@ -1,9 +1,68 @@
-import pyautogui
+import itertools
+import logging
 import os
 import time
 import sys
-import pyperclip
-from PIL import Image
+from collections import namedtuple
+import image_encoding
+import text_entry
+
+logger = logging.getLogger(__name__)
+
+# coord_scale maps coordinates on the encoded frame the model sees back to the screen
+Capture = namedtuple("Capture", ["path", "fingerprint", "coord_scale"], defaults=(None,))
+
+# Numbers screenshots taken without a step number, so names stay unique within a second
+_capture_counter = itertools.count(1)
+
+# pyautogui probes the display and pulls in PIL and friends on import, so it is
+# only loaded on first use to keep CLI startup and argument errors fast.
+_backend = None
+# Used for the pauses between and after actions; replay swaps it out to run at full speed
+_sleep = time.sleep
+# How the type action enters text, see text_entry.type_text
+TEXT_ENTRY_METHOD = text_entry.METHOD_AUTO
+
+def _get_backend():
+    """Returns the GUI automation backend, importing pyautogui on first use."""
+    global _backend
+    if _backend is None:
+        import pyautogui
+        _backend = pyautogui
+    return _backend
+
+def set_backend(backend, sleep=time.sleep):
+    """
+    Replaces the GUI automation backend, e.g. with a no-op object for offline replay.
+    sleep is used for the pauses after actions. Returns the previous (backend, sleep).
+    """
+    global _backend, _sleep
+    previous = (_backend, _sleep)
+    _backend = backend
+    _sleep = sleep
+    return previous
+
+def wait_for_display_ready(timeout=10.0, poll_interval=0.25):
+    """
+    Waits until the display can be queried and captured.
+    Returns True once a screenshot of the display succeeds, or False after the timeout.
+    """
+    deadline = time.monotonic() + timeout
+    last_error = None
+    while True:
+        try:
+            gui = _get_backend()
+            width, height = gui.size()
+            if width > 0 and height > 0:
+                gui.screenshot(region=(0, 0, 1, 1)).close()
+                return True
+            last_error = f"display reported size {width}x{height}"
+        except Exception as e:
+            last_error = e
+        if time.monotonic() >= deadline:
+            logger.warning(f"Display not ready after {timeout}s: {last_error}")
+            return False
+        time.sleep(poll_interval)
 
 def minimise_all_windows():
     """
@@ -12,25 +71,26 @@ def minimise_all_windows():
     """
     try:
         # Use Windows+D shortcut to show desktop
-        pyautogui.hotkey('win', 'd')
+        _get_backend().hotkey('win', 'd')
         return True
     except Exception as e:
-        print(f"Error minimizing windows: {e}")
+        logger.error(f"Error minimizing windows: {e}")
         return False
 
-def _get_center_coords_from_pixel_coords(coords: list):
+def _get_center_coords_from_pixel_coords(coords: list, coord_scale=None):
     """
     Converts a list of pixel coordinates [x, y] to a center point.
     Currently, it just returns the coordinates as is, assuming they are the center.
+    coord_scale maps coordinates from the encoded frame back to screen space.
     """
     if not coords or len(coords) != 2:
         return None, None
     
     try:
-        x, y = [int(c) for c in coords]
+        x, y = image_encoding.to_screen_coords([int(c) for c in coords], coord_scale)
         return x, y
     except (ValueError, TypeError) as e:
-        print(f"Error converting pixel coordinates '{coords}': {e}")
+        logger.error(f"Error converting pixel coordinates '{coords}': {e}")
         return None, None
 
 
@@ -66,62 +126,107 @@ def _get_hotkeys(key_str: str):
         
     return processed_keys
 
-def take_screenshot(session_dir):
-    """Takes a screenshot and saves it to the specified session directory."""
+def _fingerprint(image):
+    """Perceptual fingerprint of a screenshot, or None when NumPy is unavailable."""
+    try:
+        import screen_hash
+    except ImportError:
+        return None
+    return screen_hash.fingerprint(image)
+
+def capture_screen(session_dir, max_pixels=image_encoding.DEFAULT_MAX_PIXELS, formats=image_encoding.DEFAULT_FORMATS,
+                   step=None):
+    """
+    Takes a screenshot, encodes it for the model within the max_pixels budget and saves
+    it to the specified session directory. Returns Capture(path, fingerprint, coord_scale)
+    so callers can compare screen states and map model coordinates back to the screen.
+    step goes into the file name so every step's screenshot is kept; without it a
+    per-process counter is used.
+    """
     # The session directory is created by the runner script
     timestamp = time.strftime("%Y%m%d_%H%M%S")
-    screenshot_path = os.path.join(session_dir, f"screenshot_{timestamp}.png")
     
     # Take a screenshot
-    screenshot = pyautogui.screenshot()
+    gui = _get_backend()
+    screenshot = gui.screenshot()
     
     # Get logical screen size
-    logical_width, logical_height = pyautogui.size()
+    logical_width, logical_height = gui.size()
     
     # Get physical screenshot size
     physical_width, physical_height = screenshot.size
     
     # If there's a scaling factor, resize the image to the logical resolution
     if physical_width != logical_width or physical_height != logical_height:
-        print(f"Screen scaling detected. Resizing screenshot from {physical_width}x{physical_height} to {logical_width}x{logical_height}.")
-        screenshot = screenshot.resize((logical_width, logical_height), Image.Resampling.LANCZOS)
+        from PIL import Image
+        logger.debug(f"Screen scaling detected. Resizing screenshot from {physical_width}x{physical_height} to {logical_width}x{logical_height}.")
+        resized = screenshot.resize((logical_width, logical_height), Image.Resampling.LANCZOS)
+        screenshot.close()
+        screenshot = resized
+
+    try:
+        fingerprint = _fingerprint(screenshot)
+        frame = image_encoding.encode_frame(screenshot, max_pixels=max_pixels, formats=formats)
+    finally:
+        # Release the pixel buffer now rather than waiting for garbage collection
+        screenshot.close()
 
-    screenshot.save(screenshot_path)
-    return screenshot_path
+    extension = image_encoding.FILE_EXTENSIONS[frame.format]
+    if step is not None:
+        name = f"screenshot_step{step:04d}_{timestamp}{extension}"
+    else:
+        name = f"screenshot_{timestamp}_{next(_capture_counter):04d}{extension}"
+    screenshot_path = os.path.join(session_dir, name)
+    with open(screenshot_path, "wb") as f:
+        f.write(frame.data)
+    return Capture(screenshot_path, fingerprint, image_encoding.coordinate_scale(frame.image_size, frame.screen_size))
 
-def execute_action(action_data):
+def capture_fingerprint():
+    """Fingerprints the current screen without saving a screenshot."""
+    screenshot = _get_backend().screenshot()
+    try:
+        return _fingerprint(screenshot)
+    finally:
+        screenshot.close()
+
+def take_screenshot(session_dir):
+    """Takes a screenshot and saves it to the specified session directory."""
+    return capture_screen(session_dir).path
+
+def execute_action(action_data, settle_delay=2, coord_scale=None):
     """
     Executes a desktop action based on the parsed action data.
+    settle_delay is how long to wait afterwards for the UI to update.
+    coord_scale maps coordinates on the frame sent to the model back to the screen.
     """
     action_type = action_data.get("action")
     params = action_data.get("params", {})
 
     try:
+        gui = _get_backend()
+
         if action_type in ["click", "left_double", "right_single"]:
-            x, y = _get_center_coords_from_pixel_coords(params.get("start_box"))
+            x, y = _get_center_coords_from_pixel_coords(params.get("start_box"), coord_scale)
             if x is None or y is None:
-                print("Could not determine coordinates for click action.")
+                logger.warning("Could not determine coordinates for click action.")
                 return "failed"
             
-            pyautogui.moveTo(x, y, duration=0.2)
+            gui.moveTo(x, y, duration=0.2)
 
             if action_type == "click":
-                pyautogui.mouseDown()
-                time.sleep(0.1)
-                pyautogui.mouseUp()
+                gui.mouseDown()
+                _sleep(0.1)
+                gui.mouseUp()
             elif action_type == "left_double":
-                pyautogui.doubleClick()
+                gui.doubleClick()
             elif action_type == "right_single":
-                pyautogui.rightClick()
+                gui.rightClick()
 
         elif action_type == "type":
             content = params.get("content", "")
             
-            # Use clipboard for reliability on Windows
-            pyautogui.hotkey('ctrl', 'a') # Select all
-            time.sleep(0.1)
-            pyautogui.press('backspace') # Delete
-            time.sleep(0.1)
+            if text_entry.should_clear(params):
+                text_entry.clear_field(gui)
 
             content_to_type = content.strip()
             press_enter = False
@@ -132,69 +237,63 @@ def execute_action(action_data):
                 else:
                     content_to_type = content_to_type[:-1]
 
-            if sys.platform == "win32":
-                original_clipboard = pyperclip.paste()
-                pyperclip.copy(content_to_type)
-                pyautogui.hotkey('ctrl', 'v')
-                time.sleep(0.1)
-                pyperclip.copy(original_clipboard)
-            else: # For MacOS and Linux
-                pyautogui.write(content_to_type, interval=0.01)
+            # Clipboard paste on Windows and Linux, bulk typing as a fallback
+            text_entry.type_text(gui, content_to_type, TEXT_ENTRY_METHOD)
 
             if press_enter:
-                pyautogui.press('enter')
+                gui.press('enter')
 
         elif action_type == "scroll":
-            x, y = _get_center_coords_from_pixel_coords(params.get("start_box"))
+            x, y = _get_center_coords_from_pixel_coords(params.get("start_box"), coord_scale)
             if x is not None and y is not None:
-                pyautogui.moveTo(x, y, duration=0.2)
+                gui.moveTo(x, y, duration=0.2)
 
             direction = params.get("direction", "down")
             scroll_amount = -500 if direction == "down" else 500
-            pyautogui.scroll(scroll_amount)
+            gui.scroll(scroll_amount)
 
         elif action_type == "drag":
-            start_x, start_y = _get_center_coords_from_pixel_coords(params.get("start_box"))
-            end_x, end_y = _get_center_coords_from_pixel_coords(params.get("end_box"))
+            start_x, start_y = _get_center_coords_from_pixel_coords(params.get("start_box"), coord_scale)
+            end_x, end_y = _get_center_coords_from_pixel_coords(params.get("end_box"), coord_scale)
 
             if None in [start_x, start_y, end_x, end_y]:
-                print(f"Could not determine coordinates for drag operation.")
+                logger.warning(f"Could not determine coordinates for drag operation.")
                 return "failed"
             
-            pyautogui.moveTo(start_x, start_y, duration=0.2)
-            pyautogui.dragTo(end_x, end_y, duration=1.0, button='left')
+            gui.moveTo(start_x, start_y, duration=0.2)
+            gui.dragTo(end_x, end_y, duration=1.0, button='left')
 
         elif action_type == "hotkey":
             keys_str = params.get("key", "enter")
             keys = _get_hotkeys(keys_str)
             if not keys:
-                print("Invalid hotkey specification.")
+                logger.warning("Invalid hotkey specification.")
                 return "failed"
-            pyautogui.hotkey(*keys)
+            gui.hotkey(*keys)
 
         elif action_type == "wait":
-            print("Waiting for 5 seconds...")
-            time.sleep(5)
+            logger.info("Waiting for 5 seconds...")
+            _sleep(5)
             
         elif action_type == "finished":
-            print("Task marked as finished.")
+            logger.info("Task marked as finished.")
             return "stop"
 
         elif action_type == "authenticate":
-            print("Action 'authenticate' triggered. User authentication (OTP/mobile number) required.")
+            logger.info("Action 'authenticate' triggered. User authentication (OTP/mobile number) required.")
             return "authenticate"
 
         elif action_type == "call_user":
-            print("Action 'call_user' triggered. Pausing operation and waiting for user input.")
+            logger.info("Action 'call_user' triggered. Pausing operation and waiting for user input.")
             return "call_user"
 
         else:
-            print(f"Unknown action type: {action_type}")
+            logger.error(f"Unknown action type: {action_type}")
             return "failed"
 
     except Exception as e:
-        print(f"Error executing action {action_type}: {e}")
+        logger.error(f"Error executing action {action_type}: {e}")
         return "failed"
         
-    time.sleep(2) # Increased delay to ensure UI updates
+    _sleep(settle_delay) # Delay to ensure UI updates
     return "continue" 
\ No newline at end of file
@@ -0,0 +1,132 @@
+"""
+Resolution-adaptive screenshot encoding for the model.
+
+The vision encoder works on 28x28 pixel patches and the prefill cost grows with
+the number of patches, so frames are resized to a pixel budget whose sides are
+multiples of the patch size before they are sent. The model then answers in the
+coordinates of the resized frame, which to_screen_coords maps back to the screen.
+
+Each frame can be encoded in several formats; the smallest result is kept.
+"""
+
+import argparse
+import io
+import math
+import os
+from collections import namedtuple
+
+PATCH_SIZE = 28
+DEFAULT_MIN_PIXELS = 100 * PATCH_SIZE * PATCH_SIZE
+# UI-TARS 1.5 processor default; lower it to trade detail for faster prefill
+DEFAULT_MAX_PIXELS = 16384 * PATCH_SIZE * PATCH_SIZE
+DEFAULT_FORMATS = ("PNG",)
+DEFAULT_JPEG_QUALITY = 90
+
+MIME_TYPES = {"PNG": "image/png", "WEBP": "image/webp", "JPEG": "image/jpeg"}
+FILE_EXTENSIONS = {"PNG": ".png", "WEBP": ".webp", "JPEG": ".jpg"}
+
+EncodedFrame = namedtuple("EncodedFrame", ["data", "format", "image_size", "screen_size"])
+
+
+def smart_resize(width, height, factor=PATCH_SIZE, min_pixels=DEFAULT_MIN_PIXELS, max_pixels=DEFAULT_MAX_PIXELS):
+    """
+    Returns (width, height) with both sides multiples of factor, the aspect ratio
+    kept as close as possible and the pixel count within [min_pixels, max_pixels].
+    Sides are rounded down, so a frame within the budget is never enlarged.
+    """
+    if max_pixels < factor * factor:
+        raise ValueError(f"max_pixels must be at least {factor * factor}, got {max_pixels}")
+    new_width = max(factor, math.floor(width / factor) * factor)
+    new_height = max(factor, math.floor(height / factor) * factor)
+    if new_width * new_height > max_pixels:
+        beta = math.sqrt((width * height) / max_pixels)
+        new_width = max(factor, math.floor(width / beta / factor) * factor)
+        new_height = max(factor, math.floor(height / beta / factor) * factor)
+    elif new_width * new_height < min_pixels:
+        beta = math.sqrt(min_pixels / (width * height))
+        new_width = math.ceil(width * beta / factor) * factor
+        new_height = math.ceil(height * beta / factor) * factor
+    return new_width, new_height
+
+
+def _encode(image, image_format, jpeg_quality):
+    buffer = io.BytesIO()
+    if image_format == "PNG":
+        image.save(buffer, format="PNG")
+    elif image_format == "WEBP":
+        image.save(buffer, format="WEBP", lossless=True)
+    elif image_format == "JPEG":
+        image.convert("RGB").save(buffer, format="JPEG", quality=jpeg_quality)
+    else:
+        raise ValueError(f"Unsupported image format: {image_format}")
+    return buffer.getvalue()
+
+
+def encode_frame(image, max_pixels=DEFAULT_MAX_PIXELS, min_pixels=DEFAULT_MIN_PIXELS,
+                 formats=DEFAULT_FORMATS, jpeg_quality=DEFAULT_JPEG_QUALITY):
+    """
+    Resizes a PIL image to the patch-aligned pixel budget and encodes it in each of
+    formats, keeping the smallest. Returns an EncodedFrame.
+    """
+    from PIL import Image
+
+    formats = [image_format.upper() for image_format in formats]
+    unsupported = [image_format for image_format in formats if image_format not in MIME_TYPES]
+    if unsupported or not formats:
+        raise ValueError(f"Unsupported image formats: {unsupported or formats}")
+    screen_size = image.size
+    image_size = smart_resize(screen_size[0], screen_size[1], PATCH_SIZE, min_pixels, max_pixels)
+    resized = image.resize(image_size, Image.Resampling.LANCZOS) if image_size != screen_size else image
+    try:
+        best = None
+        for image_format in formats:
+            data = _encode(resized, image_format, jpeg_quality)
+            if best is None or len(data) < len(best[0]):
+                best = (data, image_format)
+    finally:
+        if resized is not image:
+            resized.close()
+    return EncodedFrame(best[0], best[1], image_size, screen_size)
+
+
+def mime_type_for_path(path):
+    """MIME type for a saved frame, based on its file extension."""
+    extension = os.path.splitext(path)[1].lower()
+    for image_format, format_extension in FILE_EXTENSIONS.items():
+        if format_extension == extension:
+            return MIME_TYPES[image_format]
+    return MIME_TYPES["PNG"]
+
+
+def coordinate_scale(image_size, screen_size):
+    """(x, y) factors that take coordinates on the encoded image to screen coordinates."""
+    if not image_size or not screen_size:
+        return None
+    return screen_size[0] / image_size[0], screen_size[1] / image_size[1]
+
+
+def to_screen_coords(coords, scale):
+    """Maps [x, y] from encoded-image space to screen space using a coordinate_scale result."""
+    if scale is None:
+        return coords
+    return [round(coords[0] * scale[0]), round(coords[1] * scale[1])]
+
+
+def max_pixels_arg(value):
+    """argparse type for --max-pixels: an integer of at least one patch."""
+    try:
+        pixels = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid pixel count: {value!r}")
+    if pixels < PATCH_SIZE * PATCH_SIZE:
+        raise argparse.ArgumentTypeError(f"must be at least {PATCH_SIZE * PATCH_SIZE} (one {PATCH_SIZE}x{PATCH_SIZE} patch)")
+    return pixels
+
+
+def formats_arg(value):
+    """argparse type for --image-formats: a comma-separated list of supported formats, as a tuple."""
+    formats = tuple(part.strip().upper() for part in value.split(",") if part.strip())
+    unsupported = [image_format for image_format in formats if image_format not in MIME_TYPES]
+    if not formats or unsupported:
+        raise argparse.ArgumentTypeError(f"choose from {', '.join(MIME_TYPES)}, got {value!r}")
+    return formats
@@ -0,0 +1,113 @@
+"""
+Screen-state-aware loop detection for the desktop agent.
+
+Each step is recorded as a (screen fingerprint, action) state in a rolling
+window. The detector reports the agent as stuck when it sees:
+  - the same action repeated on the same screen (cycle of length 1), e.g.
+    clicking a few pixels apart on a button that never reacts,
+  - a longer cycle such as A, B, A, B on the same or alternating screens.
+
+Only repeats and cycles are detected. Coordinates are compared with a spatial
+tolerance so near-identical clicks count as the same action, but different
+actions on a screen whose fingerprint does not change are never treated as a
+loop: screen fingerprints are coarse (see screen_hash) and do not see small
+changes such as a calculator digit or a ticked checkbox, so an unchanged
+fingerprint alone is not evidence that nothing happened.
+
+The defaults flag a repeated action on its 5th occurrence, the same as the
+agent's max_same_action check.
+"""
+
+from collections import deque
+
+
+class LoopDetector:
+    def __init__(self, window=12, max_repeats=5, max_cycle_length=4, cycle_repeats=2,
+                 coord_tolerance=20, screen_distance=4, ignored_actions=("wait",)):
+        """
+        window:          Number of recent states kept for cycle detection.
+        max_repeats:     Same action on the same screen this many times in a row is a loop.
+        max_cycle_length: Longest cycle (in actions) looked for.
+        cycle_repeats:   How many times a cycle longer than one action must repeat.
+        coord_tolerance: Pixels within which two coordinates are treated as the same target.
+        screen_distance: Maximum Hamming distance for two fingerprints to be the same screen.
+        ignored_actions: Actions that are not tracked (waiting on an unchanged screen is expected).
+        """
+        self.window = window
+        self.max_repeats = max_repeats
+        self.max_cycle_length = max_cycle_length
+        self.cycle_repeats = cycle_repeats
+        self.coord_tolerance = coord_tolerance
+        self.screen_distance = screen_distance
+        self.ignored_actions = set(ignored_actions)
+        self.states = deque(maxlen=window)
+
+    def reset(self):
+        self.states.clear()
+
+    def settings(self):
+        """Constructor arguments that rebuild an equivalent detector, as JSON-friendly values."""
+        return {
+            "window": self.window,
+            "max_repeats": self.max_repeats,
+            "max_cycle_length": self.max_cycle_length,
+            "cycle_repeats": self.cycle_repeats,
+            "coord_tolerance": self.coord_tolerance,
+            "screen_distance": self.screen_distance,
+            "ignored_actions": sorted(self.ignored_actions),
+        }
+
+    def _same_screen(self, a, b):
+        # Without fingerprints only the actions can be compared
+        if a is None or b is None:
+            return True
+        import screen_hash
+        return screen_hash.same_screen(a, b, self.screen_distance)
+
+    def _same_params(self, a, b):
+        if a.keys() != b.keys():
+            return False
+        for key, value in a.items():
+            other = b[key]
+            if isinstance(value, list) and isinstance(other, list) and len(value) == len(other):
+                if any(abs(x - y) > self.coord_tolerance for x, y in zip(value, other)):
+                    return False
+            elif value != other:
+                return False
+        return True
+
+    def _same_state(self, a, b):
+        return a[1] == b[1] and self._same_params(a[2], b[2]) and self._same_screen(a[0], b[0])
+
+    def _find_cycle(self):
+        """Returns the length of a detected cycle, or None."""
+        states = list(self.states)
+        for length in range(1, self.max_cycle_length + 1):
+            repeats = self.max_repeats if length == 1 else self.cycle_repeats
+            needed = length * repeats
+            if len(states) < needed:
+                continue
+            # A run of one repeated action is a cycle of length 1, judged by max_repeats alone
+            if length > 1 and all(self._same_state(states[-1 - i], states[-2 - i]) for i in range(length - 1)):
+                continue
+            if all(self._same_state(states[-1 - i], states[-1 - i - length]) for i in range(needed - length)):
+                return length
+        return None
+
+    def observe(self, fingerprint, action_data):
+        """
+        Records the screen the action was chosen on and the action itself.
+        Returns a description of the loop if the agent looks stuck, otherwise None.
+        """
+        action_name = action_data.get("action")
+        if action_name in self.ignored_actions:
+            return None
+        self.states.append((fingerprint, action_name, action_data.get("params", {})))
+
+        cycle_length = self._find_cycle()
+        if cycle_length == 1:
+            return f"'{action_name}' repeated {self.max_repeats} times in a row on the same target"
+        if cycle_length:
+            actions = [s[1] for s in list(self.states)[-cycle_length:]]
+            return f"Cycle of {cycle_length} actions ({' -> '.join(actions)}) repeated {self.cycle_repeats} times"
+        return None
@@ -11,11 +11,15 @@ Usage:
 """
 
 import argparse
-import requests
+import logging
 import sys
 import re
 import json
 
+import agent_logging
+
+logger = logging.getLogger(__name__)
+
 
 # System prompt for instruction refinement
 SYSTEM_PROMPT = """
@@ -113,29 +117,25 @@ def call_uitars_model(instruction):
         "max_tokens": 2048
     }
     
-    print("\n" + "="*60)
-    print("DEBUG: PAYLOAD BEING SENT TO SERVER")
-    print("="*60)
-    print(json.dumps(payload, indent=2))
-    print("="*60 + "\n")
+    import requests
+
+    # Serialising the payload is skipped entirely unless debug logging is on
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Payload being sent to server: %s", json.dumps(payload, indent=2))
     
     try:
-        print("Calling UI-TARS model...")
+        logger.info("Calling UI-TARS model...")
         response = requests.post(API_URL, json=payload, headers=headers, timeout=300)
         response.raise_for_status()
-        print("Response received.")
+        logger.info("Response received.")
         
         model_output = response.json()["choices"][0]["message"]["content"]
         
-        print("\n" + "="*60)
-        print("DEBUG: RAW MODEL OUTPUT (before sanitization)")
-        print("="*60)
-        print(repr(model_output))
-        print("="*60 + "\n")
+        logger.debug("Raw model output (before sanitization): %r", model_output)
         
         return model_output
     except requests.exceptions.RequestException as e:
-        print(f"Error calling UI-TARS model: {e}")
+        logger.error(f"Error calling UI-TARS model: {e}")
         return None
 
 def save_output(original, new_instruction):
@@ -159,8 +159,10 @@ def main():
     group.add_argument("instruction", nargs="?", help="Instruction text to transform into new instructions (use --file for special characters)")
     group.add_argument("--file", help="Path to a file containing instructions (recommended for special characters)")
     parser.add_argument("--output", help="Path to save new instructions (default: new_instruction.txt)")
+    parser.add_argument("--log-level", help="Log level, e.g. DEBUG to dump the request payload and raw output (default: INFO)")
 
     args = parser.parse_args()
+    agent_logging.configure(args.log_level)
     
     # Get instruction from command line or file
     if args.file:
@@ -168,20 +170,20 @@ def main():
             with open(args.file, "r", encoding="utf-8") as f:
                 instruction = f.read()
         except Exception as e:
-            print(f"Error reading file: {e}")
+            logger.error(f"Error reading file: {e}")
             sys.exit(2)  
     else:
         instruction = args.instruction
 
     # Validate instruction is not empty
     if not instruction or not instruction.strip():
-        print("Error: Empty instruction provided.")
+        logger.error("Error: Empty instruction provided.")
         sys.exit(2)  
 
     # Call model
     new_instruction = call_uitars_model(instruction)
     if not new_instruction:
-        print("Failed to generate new instructions.")
+        logger.error("Failed to generate new instructions.")
         sys.exit(1) 
 
     new_instruction = sanitise_instruction(new_instruction)
@@ -195,6 +197,7 @@ def main():
     else:
         output_file = save_output(instruction, new_instruction)
     
+    agent_logging.flush()
     print(f"\nNew instructions saved to: {output_file}")
     print("\nNew Instructions:")
     print("-" * 40)
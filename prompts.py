@@ -1,10 +1,19 @@
-def get_simple_system_prompt():
+def get_simple_system_prompt(plan_mode=False, max_plan_actions=3):
     """
     Returns the system prompt for the GUI agent.
+    In plan mode the model may return up to max_plan_actions actions per step.
     """
+    if plan_mode:
+        action_rule = (
+            f"You must ONLY use the provided action space and output between 1 and {max_plan_actions} actions per step, "
+            "one per line, in the order they should run. "
+            "Only batch actions whose targets are all visible in the current screenshot. "
+        )
+    else:
+        action_rule = "You must ONLY use the provided action space and output EXACTLY ONE action per step. "
     return (
         "You are a highly precise GUI automation agent. "
-        "You must ONLY use the provided action space and output EXACTLY ONE action per step. "
+        + action_rule +
         "Strictly follow the sequence of steps given by the user instruction. "
         "DO NOT perform any actions beyond those listed. "
         "IMPORTANT: If you see any phone number input field, OTP field, verification code field, or 2FA prompt, "
@@ -15,7 +24,7 @@ def get_simple_system_prompt():
     )
 
 
-def get_detailed_user_prompt(instruction):
+def get_detailed_user_prompt(instruction, plan_mode=False, max_plan_actions=3):
     """
     Returns the detailed user prompt including action space and user instruction.
     """
@@ -26,7 +35,7 @@ def get_detailed_user_prompt(instruction):
         "right_single(start_box='(x,y)')",
         "drag(start_box='(x1,y1)', end_box='(x2,y2)')",
         "hotkey(key='ctrl c')   # Keys are lowercase, space-separated. Max 3 keys.",
-        "type(content='text')   # Use escape chars (\\', \\\", \\n). Add \\n if Enter is needed.",
+        "type(content='text')   # Use escape chars (\\', \\\", \\n). Add \\n if Enter is needed. Add clear='false' to keep existing text.",
         "scroll(start_box='(x,y)', direction='down')   # Direction: down, up, left, right.",
         "wait()   # Sleep 5s and take a screenshot to check for changes.",
         "finished()   # Task done.",
@@ -34,6 +43,17 @@ def get_detailed_user_prompt(instruction):
         "call_user() # Use this if blocked, task unsolvable, or user input or control is needed",
     ]
 
+    if plan_mode:
+        action_rule = (
+            f"- Output 1 to {max_plan_actions} actions per step, one per line, e.g. click a field, type its value, press Enter.\n"
+            "- Only batch actions whose targets are visible in the current screenshot; end the batch before any action that changes the page.\n"
+            "- `wait()`, `finished()`, `authenticate()` and `call_user()` must be the only or the last action."
+        )
+        output_format = "Action: one_action_from_action_space\n  one_action_from_action_space (optional)"
+    else:
+        action_rule = "- Output exactly ONE action per step."
+        output_format = "Action: one_action_from_action_space"
+
     return f"""
 You are a GUI agent. You are given a task and its action history with screenshots. 
 Strictly follow the sequence of steps below. 
@@ -41,7 +61,7 @@ Do not perform any actions beyond those explicitly listed in the instruction.
 If the flow deviates or an unexpected behavior occurs, stop immediately and use `call_user()`.
 
 RULES:
-- Output exactly ONE action per step.
+{action_rule}
 - Only perform the action explicitly stated in the instruction.
 - Do NOT try to perform, infer, or add extra actions beyond what is listed.
 - Use English in `Thought`.
@@ -50,7 +70,7 @@ RULES:
 ## Output Format
 
   Thought: Explain briefly why this is the correct next step.
-  Action: one_action_from_action_space
+  {output_format}
 
 
   ## Action Space
@@ -0,0 +1,227 @@
+"""
+Replays recorded sessions through the agent logic without a model or a desktop.
+
+Each steps.jsonl under the given paths is fed back, step by step, through
+action_parser and DesktopAgent.parse_and_execute (loop detection, plan
+handling and the terminal-action checks) with a no-op desktop_controller
+backend and no pauses, so thousands of historical steps run in seconds.
+
+The replayed status and parsed actions are compared with the recorded ones. A
+mismatch means the agent logic now reacts differently to the same model
+output, or that the recorded action failed on the real desktop. Secrets were
+masked as *** when the steps were recorded; steps whose masked output no
+longer replays the same way are counted separately rather than as mismatches.
+
+Usage:
+  python replay.py [session ...] [--profile] [--profile-output replay.prof]
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter, deque
+
+import agent_logging
+import desktop_controller
+import step_log
+import text_entry
+from desktop_agent_core import DesktopAgent
+from loop_detector import LoopDetector
+
+logger = logging.getLogger(__name__)
+
+# Screens recorded between the actions of a plan, handed out in order by _recorded_fingerprint
+_plan_screens = deque()
+
+
+class NoopBackend:
+    """Stands in for pyautogui: accepts every call and only counts it."""
+
+    def __init__(self):
+        self.calls = Counter()
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            self.calls[name] += 1
+        return call
+
+
+def _recorded_fingerprint():
+    return _plan_screens.popleft() if _plan_screens else None
+
+
+def _normalise(actions):
+    """Parsed actions as they look after a JSON round trip, so recorded and replayed ones compare equal."""
+    return json.loads(json.dumps(actions))
+
+
+def _record_settings(record):
+    """The agent settings a step was recorded with; logs written before settings were recorded only carry the plan settings."""
+    if "settings" in record:
+        return record["settings"]
+    return {"plan_mode": record.get("plan_mode", False), "max_plan_actions": record.get("max_plan_actions", 3)}
+
+
+def _build_agent(session_dir, settings):
+    """Creates a non-recording agent, and its loop detector, with the recorded settings."""
+    settings = dict(settings)
+    loop_detector = LoopDetector(**settings.pop("loop_detector", {}))
+    return DesktopAgent(session_dir=session_dir, record_steps=False, loop_detector=loop_detector, **settings)
+
+
+def replay_session(path):
+    """
+    Replays one steps.jsonl with an agent built from the recorded settings. The agent is
+    reset wherever the step number starts again, as the live agent was between instructions.
+    Returns (steps replayed, steps skipped, steps differing only where secrets were masked,
+    mismatches, recorded timing totals, replay seconds).
+    """
+    records = list(step_log.read_steps(path))
+    replayed = 0
+    skipped = 0
+    masked = 0
+    mismatches = []
+    recorded_ms = Counter()
+    replay_seconds = 0.0
+    if not records:
+        return replayed, skipped, masked, mismatches, recorded_ms, replay_seconds
+
+    agent = None
+    settings = None
+    previous_step = 0
+    for record in records:
+        record_settings = _record_settings(record)
+        step = record.get("step", 0)
+        if record_settings != settings:
+            agent = _build_agent(os.path.dirname(path), record_settings)
+            settings = record_settings
+        elif step <= previous_step:
+            agent.reset()
+        previous_step = step
+
+        model_output = record.get("model_output")
+        if model_output is None:
+            # The model call failed, so the live agent never ran its logic for this step
+            skipped += 1
+            continue
+
+        coord_scale = record.get("coord_scale")
+        agent.coord_scale = tuple(coord_scale) if coord_scale else None
+        fingerprint = step_log.fingerprint_from_json(record.get("fingerprint"))
+        _plan_screens.clear()
+        _plan_screens.extend(step_log.fingerprint_from_json(f) for f in record.get("plan_fingerprints", []))
+        agent.last_step = {}
+
+        started = time.perf_counter()
+        status = agent.parse_and_execute(model_output, fingerprint)
+        replay_seconds += time.perf_counter() - started
+        replayed += 1
+        for name, value in record.get("timings_ms", {}).items():
+            recorded_ms[name] += value
+
+        actions = _normalise(agent.last_step.get("actions", []))
+        differs = status != record.get("status") or actions != record.get("actions", [])
+        if differs and "***" in model_output:
+            # e.g. a masked OTP that the parser cannot read back the same way
+            masked += 1
+        elif status != record.get("status"):
+            mismatches.append(f"{path} step {record.get('step')}: recorded status '{record.get('status')}', replayed '{status}'")
+        elif actions != record.get("actions", []):
+            mismatches.append(f"{path} step {record.get('step')}: recorded actions {record.get('actions')}, replayed {actions}")
+
+    return replayed, skipped, masked, mismatches, recorded_ms, replay_seconds
+
+
+def replay(paths, profile=False, profile_output=None, top=25):
+    """Replays every step log under paths and prints a summary. Returns the exit code."""
+    logs = step_log.find_step_logs(paths)
+    if not logs:
+        print(f"No {step_log.STEP_LOG_NAME} found under: {', '.join(paths)}")
+        return 2
+
+    backend = NoopBackend()
+    previous_backend = desktop_controller.set_backend(backend, sleep=lambda _seconds: None)
+    previous_capture_fingerprint = desktop_controller.capture_fingerprint
+    previous_text_entry_method = desktop_controller.TEXT_ENTRY_METHOD
+    desktop_controller.capture_fingerprint = _recorded_fingerprint
+    # Keystrokes go to the no-op backend; paste and xdotool would touch the real clipboard and display
+    desktop_controller.TEXT_ENTRY_METHOD = text_entry.METHOD_KEYSTROKES
+
+    profiler = None
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+
+    total_replayed = 0
+    total_skipped = 0
+    total_masked = 0
+    all_mismatches = []
+    recorded_ms = Counter()
+    replay_seconds = 0.0
+    started = time.perf_counter()
+    try:
+        if profiler:
+            profiler.enable()
+        for path in logs:
+            replayed, skipped, masked, mismatches, session_ms, session_seconds = replay_session(path)
+            total_replayed += replayed
+            total_skipped += skipped
+            total_masked += masked
+            all_mismatches.extend(mismatches)
+            recorded_ms.update(session_ms)
+            replay_seconds += session_seconds
+    finally:
+        if profiler:
+            profiler.disable()
+        desktop_controller.set_backend(*previous_backend)
+        desktop_controller.capture_fingerprint = previous_capture_fingerprint
+        desktop_controller.TEXT_ENTRY_METHOD = previous_text_entry_method
+    elapsed = time.perf_counter() - started
+
+    print(f"Replayed {total_replayed} steps from {len(logs)} sessions in {elapsed:.2f}s "
+          f"({total_replayed / elapsed if elapsed else 0:.0f} steps/s); skipped {total_skipped} without model output.")
+    if total_masked:
+        print(f"{total_masked} steps differ only where secrets were masked; not counted as mismatches.")
+    if total_replayed:
+        recorded = ", ".join(f"{name} {value / total_replayed:.1f}" for name, value in sorted(recorded_ms.items()))
+        print(f"Recorded mean ms per step: {recorded}")
+        print(f"Replayed mean ms per step: parse and execute {replay_seconds * 1000 / total_replayed:.3f}")
+    print(f"Backend calls: {dict(backend.calls)}")
+
+    if profiler:
+        import pstats
+        if profile_output:
+            profiler.dump_stats(profile_output)
+            print(f"Profile written to {profile_output}")
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats("cumulative").print_stats(top)
+
+    if all_mismatches:
+        print(f"{len(all_mismatches)} mismatches:")
+        for mismatch in all_mismatches:
+            print(f"  {mismatch}")
+        return 1
+    print("OK: replay matches the recorded steps.")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded agent sessions offline for regression checks and profiling.")
+    parser.add_argument("paths", nargs="*", default=["session"], help="Session directories or steps.jsonl files (default: session)")
+    parser.add_argument("--profile", action="store_true", help="Profile the replay with cProfile.")
+    parser.add_argument("--profile-output", type=str, default=None, help="Write the cProfile stats to this file.")
+    parser.add_argument("--top", type=int, default=25, help="Functions to list in the profile (default: 25).")
+    parser.add_argument("--log-level", type=str, default="WARNING", help="Log level for agent output during replay (default: WARNING).")
+    args = parser.parse_args()
+    agent_logging.configure(args.log_level)
+
+    sys.exit(replay(args.paths, args.profile, args.profile_output, args.top))
+
+
+if __name__ == "__main__":
+    main()
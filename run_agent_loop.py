@@ -1,92 +1,127 @@
 import subprocess
 import os
-import time
 import sys
 import signal
 import uuid
 import argparse
+import logging
+import agent_logging
+import image_encoding
+
+logger = logging.getLogger(__name__)
 
 def safe_exit(signal_received=None, frame=None):
     """Handle Ctrl+C gracefully"""
-    print("\nOperation interrupted by user.")
+    logger.warning("Operation interrupted by user.")
     sys.exit(130) 
 
-def main():
-    signal.signal(signal.SIGINT, safe_exit)
-
-    if len(sys.argv) < 2:
-        print("Usage: python run_agent_loop.py <instructions_file> [--otp OTP_VALUE] [--mobile MOBILE_NUMBER]")
-        sys.exit(2)
-
-    # Set up OTP and mobile number arguments
-    parser = argparse.ArgumentParser(description='Run agent loop with instructions file and optional OTP/mobile number')
-    parser.add_argument('instructions_file', help='Path to the instructions file')
-    parser.add_argument('--otp', help='OTP value to replace $Number in instructions')
-    parser.add_argument('--mobile', help='Mobile number to replace $Mobile in instructions')
-    
-    args = parser.parse_args()
-    
-    instructions_file = args.instructions_file
-    otp_value = args.otp
-    mobile_value = args.mobile
-
-    instructions_file = sys.argv[1]
-
+def load_instructions(instructions_file, otp_value=None, mobile_value=None):
+    """
+    Reads an instructions file, applies the $Number/$Mobile substitutions and
+    splits it into instruction blocks separated by empty lines.
+    Raises ValueError with a printable message when the file cannot be used.
+    """
     if not os.path.exists(instructions_file):
-        print(f"Instructions file not found: {instructions_file}")
-        sys.exit(2)
+        raise ValueError(f"Instructions file not found: {instructions_file}")
 
     try:
         # Read and split instructions by empty lines
         with open(instructions_file, "r", encoding="utf-8") as f:
             raw = f.read()
     except Exception as e:
-        print(f"Error reading instructions file:{e}")
-        sys.exit(2)
-        
+        raise ValueError(f"Error reading instructions file:{e}")
+
+    # Keep OTP and mobile values out of every log record
+    agent_logging.add_secret(otp_value)
+    agent_logging.add_secret(mobile_value)
+
     #Replace $Number with OTP value if provided
     if otp_value is not None:
         raw = raw.replace("$Number", otp_value)
-        print(f"Replaced $Number with OTP value: {otp_value}")
-    
+        logger.info(f"Replaced $Number with OTP value: {otp_value}")
+
     #Replace $Mobile with mobile number if provided
     if mobile_value is not None:
         raw = raw.replace("$Mobile", mobile_value)
-        print(f"Replaced $Mobile with mobile number: {mobile_value}")
+        logger.info(f"Replaced $Mobile with mobile number: {mobile_value}")
 
     instructions = [block.strip() for block in raw.split("\n\n") if block.strip()]
 
     if not instructions:
-        print("No instructions found in the file. Exiting.")
+        raise ValueError("No instructions found in the file. Exiting.")
+
+    return instructions
+
+def main():
+    signal.signal(signal.SIGINT, safe_exit)
+    agent_logging.configure()
+
+    if len(sys.argv) < 2:
+        logger.error("Usage: python run_agent_loop.py <instructions_file> [--otp OTP_VALUE] [--mobile MOBILE_NUMBER]")
+        sys.exit(2)
+
+    # Set up OTP and mobile number arguments
+    parser = argparse.ArgumentParser(description='Run agent loop with instructions file and optional OTP/mobile number')
+    parser.add_argument('instructions_file', help='Path to the instructions file')
+    parser.add_argument('--otp', help='OTP value to replace $Number in instructions')
+    parser.add_argument('--mobile', help='Mobile number to replace $Mobile in instructions')
+    parser.add_argument('--ready-timeout', type=float, default=10.0, help='Seconds each instruction waits for the display to become ready (default: 10)')
+    parser.add_argument('--plan-mode', action='store_true', help='Let the model return several actions per step')
+    parser.add_argument('--max-plan-actions', type=int, default=3, help='Maximum actions per step in plan mode (default: 3)')
+    parser.add_argument('--max-pixels', type=image_encoding.max_pixels_arg, help='Pixel budget for screenshots sent to the model')
+    parser.add_argument('--image-formats', type=image_encoding.formats_arg, help='Comma-separated formats to try, e.g. PNG,WEBP (default: PNG)')
+    parser.add_argument('--log-level', help='Log level for this and each instruction run, e.g. DEBUG (default: INFO)')
+    
+    args = parser.parse_args()
+    agent_logging.configure(args.log_level)
+
+    try:
+        instructions = load_instructions(args.instructions_file, args.otp, args.mobile)
+    except ValueError as e:
+        logger.error(e)
         sys.exit(2)
 
-    time.sleep(2)
+    # Child runs inherit the log level and the values to redact
+    child_env = dict(os.environ)
+    if args.log_level:
+        child_env[agent_logging.LEVEL_ENV] = args.log_level
+    child_env[agent_logging.REDACT_ENV] = agent_logging.secrets_for_env()
 
     # Create a single parent session ID for all instructions in this batch
     parent_session_id = uuid.uuid4().hex
-    print(f"\n--- [Batch Session] All instructions will be grouped under: session_{parent_session_id} ---\n")
+    logger.info(f"--- [Batch Session] All instructions will be grouped under: session_{parent_session_id} ---")
 
     # Run each instruction sequentially
     for idx, instr in enumerate(instructions, start=1):
-        print(f"\n--- [Instruction {idx}/{len(instructions)}] Sending instruction ---\n{instr}\nUsing parent session: session_{parent_session_id}\n")
-        time.sleep(2)
+        logger.info(f"--- [Instruction {idx}/{len(instructions)}] Sending instruction ---\n{instr}\nUsing parent session: session_{parent_session_id}")
+        command = ["python", "run_with_arguments.py", instr, "--session-id", parent_session_id,
+                   "--ready-timeout", str(args.ready_timeout)]
+        if args.plan_mode:
+            command.extend(["--plan-mode", "--max-plan-actions", str(args.max_plan_actions)])
+        if args.max_pixels:
+            command.extend(["--max-pixels", str(args.max_pixels)])
+        if args.image_formats:
+            command.extend(["--image-formats", ",".join(args.image_formats)])
+        # Make sure queued log lines reach the console before the child starts writing to it
+        agent_logging.flush()
         result = subprocess.run(
-            ["python", "run_with_arguments.py", instr, "--session-id", parent_session_id],
+            command,
             stdout=sys.stdout,
             stderr=sys.stderr,
-            text=True
+            text=True,
+            env=child_env
         )
 
         if result.returncode == 3:
-            print(f"\n--- [Authentication Required] Instruction {idx} requested authentication (OTP/mobile number) ---")
-            print("Exit code 3 returned. You can now execute the OTP/mobile number instructions.")
-            print("Note: Use --otp and --mobile arguments if you have OTP/mobile values to pass.\n")
+            logger.info(f"--- [Authentication Required] Instruction {idx} requested authentication (OTP/mobile number) ---")
+            logger.info("Exit code 3 returned. You can now execute the OTP/mobile number instructions.")
+            logger.info("Note: Use --otp and --mobile arguments if you have OTP/mobile values to pass.")
             sys.exit(3)
         elif result.returncode != 0:
-            print("Stopping execution of remaining instructions.")
+            logger.info("Stopping execution of remaining instructions.")
             sys.exit(result.returncode)
 
-    print("\nAll instructions completed successfully.")
+    logger.info("All instructions completed successfully.")
     sys.exit(0)
 
 if __name__ == "__main__":
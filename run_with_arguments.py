@@ -1,46 +1,33 @@
 from desktop_agent_core import DesktopAgent
+import desktop_controller
+import agent_logging
+import image_encoding
 import argparse
+import logging
 import sys
 import time
 import os
 from datetime import datetime
 import signal
 
-class StreamLogger:
-    """Redirect stdout to both console and a log file."""
-    def __init__(self, log_file_path):
-        self.terminal = sys.stdout
-        self.log_file = open(log_file_path, 'w', encoding='utf-8')
+logger = logging.getLogger(__name__)
 
-    def write(self, message):
-        self.terminal.write(message)
-        self.log_file.write(message)
-
-    def flush(self):
-        self.terminal.flush()
-        self.log_file.flush()
-
-    def close(self):
-        self.log_file.close()
+# Steps that fail in a row (model unreachable, unparseable output, failed action) before giving up
+MAX_CONSECUTIVE_ERRORS = 5
+ERROR_STATUSES = ("api_error", "parse_error", "failed")
 
 def safe_exit(signal_received=None, frame=None):
-    print("\nOperation interrupted by user.")
+    logger.warning("Operation interrupted by user.")
     sys.exit(130)
 
-def main():
-    signal.signal(signal.SIGINT, safe_exit)
-    
-    parser = argparse.ArgumentParser(description="Desktop agent to automate tasks based on user instructions.")
-    parser.add_argument("instruction", type=str, help="Instruction for the desktop agent.")
-    parser.add_argument("--session-id", type=str, default=None, help="Optional session ID to reuse an existing session folder.")
-    args = parser.parse_args()
-
-    instruction = args.instruction
-
-    # Create a session directory for screenshots and logs
-    if args.session_id:
+def create_session_dir(session_id=None):
+    """
+    Creates the session directory for screenshots and logs and returns its path.
+    With a session ID the directory is nested as session/session_<id>/session_<datetime>.
+    """
+    if session_id:
         # Create nested structure: session/session_uniqueID/session_datetime
-        parent_session_dir = os.path.join("session", f"session_{args.session_id}")
+        parent_session_dir = os.path.join("session", f"session_{session_id}")
         os.makedirs(parent_session_dir, exist_ok=True)
         
         # Create datetime subfolder for this specific instruction
@@ -51,47 +38,104 @@ def main():
         session_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         session_dir = os.path.join("session", f"session_{session_timestamp}")
 
+    # Instructions started within the same second must not share a folder
+    base_session_dir = session_dir
+    suffix = 1
+    while os.path.exists(session_dir):
+        suffix += 1
+        session_dir = f"{base_session_dir}_{suffix}"
+
     os.makedirs(session_dir, exist_ok=True)
-    log_file_path = os.path.join(session_dir, "session_log.txt")
-    logger = StreamLogger(log_file_path)
-    original_stdout = sys.stdout
-    original_stderr = sys.stderr
-    sys.stdout = logger
-    sys.stderr = logger
+    return session_dir
+
+def run_instruction(agent, instruction, on_step=None, max_consecutive_errors=MAX_CONSECUTIVE_ERRORS,
+                    deadline=None, should_stop=None):
+    """
+    Steps the agent until the instruction reaches a terminal status and returns the exit code.
+    on_step, if given, is called with (step_number, status, elapsed_seconds) after every step.
+    Gives up with exit code 2 after max_consecutive_errors failed steps in a row or once the
+    time.monotonic() deadline has passed, and stops with 130 when should_stop() returns True.
+    """
+    step_number = 0
+    consecutive_errors = 0
+    while True:
+        if should_stop and should_stop():
+            logger.info("Instruction cancelled. Exiting with code 130.")
+            return 130
+        if deadline is not None and time.monotonic() >= deadline:
+            logger.warning("Instruction ran out of time. Exiting with code 2.")
+            return 2
+        step_number += 1
+        agent_logging.set_context(step=step_number)
+        step_started = time.perf_counter()
+        try:
+            status = agent.step(instruction)
+        except Exception as e:
+            logger.error(f"Exception from agent.step(): {e}")
+            if on_step:
+                on_step(step_number, "exception", time.perf_counter() - step_started)
+            return 2
+
+        if on_step:
+            on_step(step_number, status, time.perf_counter() - step_started)
+
+        if status == "finished":
+            logger.info("Instruction finished successfully.")
+            return 0
+        elif status == "authenticate":
+            logger.info("Instruction requested user authentication (OTP/mobile number). Exiting with code 3.")
+            return 3
+        elif status == "call_user":
+            logger.info("Instruction requested user intervention. Exiting with code 1.")
+            return 1
+        elif status in ERROR_STATUSES:
+            consecutive_errors += 1
+            if consecutive_errors >= max_consecutive_errors:
+                logger.error(f"{consecutive_errors} steps failed in a row (last status: {status}). Exiting with code 2.")
+                return 2
+            time.sleep(0.8)
+        else:
+            # Continue until agent returns finished, authenticate, or call_user
+            consecutive_errors = 0
+            time.sleep(0.8)
+
+def main():
+    signal.signal(signal.SIGINT, safe_exit)
+    
+    parser = argparse.ArgumentParser(description="Desktop agent to automate tasks based on user instructions.")
+    parser.add_argument("instruction", type=str, help="Instruction for the desktop agent.")
+    parser.add_argument("--session-id", type=str, default=None, help="Optional session ID to reuse an existing session folder.")
+    parser.add_argument("--ready-timeout", type=float, default=10.0, help="Seconds to wait for the display to become ready (default: 10).")
+    parser.add_argument("--plan-mode", action="store_true", help="Let the model return up to --max-plan-actions actions per step.")
+    parser.add_argument("--max-plan-actions", type=int, default=3, help="Maximum actions per step in plan mode (default: 3).")
+    parser.add_argument("--max-pixels", type=image_encoding.max_pixels_arg, default=image_encoding.DEFAULT_MAX_PIXELS, help="Pixel budget for screenshots sent to the model (default: %(default)s).")
+    parser.add_argument("--image-formats", type=image_encoding.formats_arg, default=",".join(image_encoding.DEFAULT_FORMATS), help="Comma-separated formats to try; the smallest is sent, e.g. PNG,WEBP (default: %(default)s).")
+    parser.add_argument("--log-level", type=str, default=None, help="Log level, e.g. DEBUG or INFO (default: $AGENT_LOG_LEVEL or INFO).")
+    args = parser.parse_args()
+    agent_logging.configure(args.log_level)
+
+    instruction = args.instruction
+
+    # Create a session directory for screenshots and logs
+    session_dir = create_session_dir(args.session_id)
+    agent_logging.open_session_log(session_dir)
 
     try:
-        print(f"Session data will be saved in: {session_dir}")
-        time.sleep(5)
-        agent = DesktopAgent(session_dir=session_dir)
-        finished = False
-        while not finished:
-            try:
-                status = agent.step(instruction)
-            except Exception as e:
-                print(f"Exception from agent.step(): {e}")
-                sys.exit(2)
-
-            if status == "finished":
-                print("Instruction finished successfully.\n")
-                sys.exit(0)
-            elif status == "authenticate":
-                print("Instruction requested user authentication (OTP/mobile number). Exiting with code 3.\n")
-                sys.exit(3)
-            elif status == "call_user":
-                print("Instruction requested user intervention. Exiting with code 1.\n")
-                sys.exit(1)
-            else:
-                # Continue until agent returns finished, authenticate, or call_user
-                time.sleep(0.8)
-
-        print("\nAll instruction blocks completed successfully.")
+        logger.info(f"Session data will be saved in: {session_dir}")
+        if not desktop_controller.wait_for_display_ready(timeout=args.ready_timeout):
+            logger.error("Display is not ready. Exiting with code 2.")
+            sys.exit(2)
+        agent = DesktopAgent(session_dir=session_dir, plan_mode=args.plan_mode, max_plan_actions=args.max_plan_actions,
+                             image_max_pixels=args.max_pixels, image_formats=args.image_formats)
+        sys.exit(run_instruction(agent, instruction))
 
+    except Exception:
+        # Logged here, while the session log is still open, rather than by the excepthook after it closes
+        logger.exception("Unhandled error. Exiting with code 2.")
+        sys.exit(2)
     finally:
-        # restore stdout/stderr and close logger
-        sys.stdout = original_stdout
-        sys.stderr = original_stderr
-        logger.close()
+        agent_logging.close_session_log()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,201 @@
+"""
+Perceptual hashing for screens and screen regions.
+
+Frames are reduced to a 32x32 grayscale grid before any arithmetic. Each
+fingerprint holds a 64-bit aHash, dHash and pHash of the whole frame plus a
+64-bit aHash for each tile of a coarse 4x4 grid.
+
+These are coarse fingerprints: one grid cell covers about 60x34 pixels of a
+1080p screen, so they react to changes over a large area (a page or dialog
+change, a panel opening, scrolling) and can miss small local ones such as a
+checkbox tick, a caret or a few typed characters. Do not treat "same screen"
+as proof that an action had no effect.
+
+PIL images, which is what capture_screen passes, are box-averaged down to the
+grid so every pixel contributes; this takes about 2 ms for a 1080p frame
+(benchmark.py hashing). NumPy arrays are point-sampled on a 64x64 grid instead (a
+fraction of a millisecond), which aliases: changes between the sampled pixels
+are not seen at all. Pass a PIL image where accuracy matters.
+"""
+
+from array import array
+from collections import namedtuple
+
+import numpy as np
+
+HASH_SIZE = 8
+SAMPLE_SIZE = 32
+TILE_GRID = 4
+
+Fingerprint = namedtuple("Fingerprint", ["ahash", "dhash", "phash", "tiles"])
+
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+_sample_index_cache = {}
+_BOX = 4  # PIL.Image.Resampling.BOX, without importing PIL for array-only callers
+
+
+def _dct_matrix(n):
+    """Orthonormal DCT-II matrix, so a 2D DCT is D @ X @ D.T."""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+_DCT = _dct_matrix(SAMPLE_SIZE)
+_DCT_LOW = np.ascontiguousarray(_DCT[:HASH_SIZE])
+
+
+def _sample_indices(height, width):
+    """Row and column indices for a 2x oversampled grid, cached per frame shape."""
+    key = (height, width)
+    indices = _sample_index_cache.get(key)
+    if indices is None:
+        size = SAMPLE_SIZE * 2
+        rows = np.linspace(0, height - 1, size).astype(np.intp)
+        cols = np.linspace(0, width - 1, size).astype(np.intp)
+        indices = (rows[:, None], cols[None, :])
+        _sample_index_cache[key] = indices
+    return indices
+
+
+def _to_array(frame):
+    """
+    Accepts a NumPy array or a PIL image. Arrays are returned as they are (and point-sampled
+    later); PIL images are area-averaged to a small square first so no pixel is skipped.
+    """
+    if isinstance(frame, np.ndarray):
+        return frame
+    size = SAMPLE_SIZE * 2
+    # reducing_gap lets PIL do an integer box reduction in C before the final box filter
+    reduced = frame.resize((size, size), resample=_BOX, reducing_gap=1.0)
+    try:
+        return np.asarray(reduced)
+    finally:
+        reduced.close()
+
+
+def downscale(frame):
+    """
+    Reduces a frame (PIL image, or array of H x W, H x W x 3 or H x W x 4) to a SAMPLE_SIZE
+    square grayscale array. The input is brought to a 2x grid (see _to_array) and then
+    box-averaged, which also suppresses single-pixel noise such as a blinking caret.
+    """
+    pixels = _to_array(frame)
+    size = SAMPLE_SIZE * 2
+    if pixels.shape[0] == size and pixels.shape[1] == size:
+        # Already on the 2x grid (always the case for PIL images)
+        sampled = pixels
+    else:
+        rows, cols = _sample_indices(pixels.shape[0], pixels.shape[1])
+        sampled = pixels[rows, cols]
+    if sampled.ndim == 3:
+        gray = sampled[..., :3].astype(np.float32) @ _LUMA
+    else:
+        gray = sampled.astype(np.float32)
+    return gray.reshape(SAMPLE_SIZE, 2, SAMPLE_SIZE, 2).mean(axis=(1, 3))
+
+
+def _pack_bits(bits):
+    """Packs rows of 64 booleans into unsigned 64-bit integers."""
+    return np.packbits(bits.reshape(-1, 64), axis=1).view(">u8").ravel()
+
+
+def average_hash(gray):
+    """aHash: each 8x8 cell brighter than the mean of the frame."""
+    cells = gray.reshape(HASH_SIZE, SAMPLE_SIZE // HASH_SIZE, HASH_SIZE, SAMPLE_SIZE // HASH_SIZE).mean(axis=(1, 3))
+    return int(_pack_bits(cells > cells.mean())[0])
+
+
+def difference_hash(gray):
+    """dHash: horizontal brightness gradient on a 9x8 grid."""
+    step = SAMPLE_SIZE // HASH_SIZE
+    rows = gray.reshape(HASH_SIZE, step, SAMPLE_SIZE).mean(axis=1)
+    cols = np.linspace(0, SAMPLE_SIZE - 1, HASH_SIZE + 1).astype(np.intp)
+    reduced = rows[:, cols]
+    return int(_pack_bits(reduced[:, 1:] > reduced[:, :-1])[0])
+
+
+def perceptual_hash(gray):
+    """pHash: low-frequency DCT coefficients compared against their median."""
+    low = _DCT_LOW @ gray @ _DCT_LOW.T
+    return int(_pack_bits(low > np.median(low.ravel()[1:]))[0])
+
+
+def tile_hashes(gray, grid=TILE_GRID):
+    """aHash of each tile in a grid x grid layout, row by row, as a uint64 array."""
+    tile = SAMPLE_SIZE // grid
+    tiles = gray.reshape(grid, tile, grid, tile).transpose(0, 2, 1, 3).reshape(grid * grid, tile, tile)
+    if tile != HASH_SIZE:
+        factor = tile // HASH_SIZE
+        tiles = tiles.reshape(grid * grid, HASH_SIZE, factor, HASH_SIZE, factor).mean(axis=(2, 4))
+    flat = tiles.reshape(grid * grid, HASH_SIZE * HASH_SIZE)
+    return _pack_bits(flat > flat.mean(axis=1, keepdims=True)).astype(np.uint64)
+
+
+def fingerprint(frame):
+    """Computes the full Fingerprint of a frame (NumPy array or PIL image)."""
+    gray = downscale(frame)
+    return Fingerprint(average_hash(gray), difference_hash(gray), perceptual_hash(gray), tile_hashes(gray))
+
+
+def hamming_distance(a, b):
+    """Number of differing bits between two 64-bit hashes."""
+    return bin(a ^ b).count("1")
+
+
+def hamming_distances(hashes, query):
+    """Hamming distance from query to every hash in a uint64 array."""
+    xor = np.bitwise_xor(np.asarray(hashes, dtype=np.uint64), np.uint64(query))
+    return _POPCOUNT8[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def changed_tiles(a, b, max_distance=6):
+    """Indices of tiles whose hashes differ by more than max_distance bits between two fingerprints."""
+    distances = _POPCOUNT8[np.bitwise_xor(a.tiles, b.tiles).view(np.uint8)].reshape(-1, 8).sum(axis=1)
+    return np.flatnonzero(distances > max_distance).tolist()
+
+
+def same_screen(a, b, max_distance=4):
+    """True when two fingerprints are close enough to be treated as the same screen."""
+    if a is None or b is None:
+        return False
+    return hamming_distance(a.phash, b.phash) <= max_distance and hamming_distance(a.dhash, b.dhash) <= max_distance
+
+
+class HashIndex:
+    """
+    Compact index of 64-bit hashes with an optional value per entry.
+    Hashes are stored in an array('Q') and searched with a vectorised popcount.
+    """
+
+    def __init__(self):
+        self.hashes = array("Q")
+        self.values = []
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def add(self, hash_value, value=None):
+        self.hashes.append(hash_value)
+        self.values.append(value)
+        return len(self.hashes) - 1
+
+    def search(self, hash_value, max_distance=4):
+        """Returns [(distance, position, value)] for entries within max_distance, closest first."""
+        if not self.hashes:
+            return []
+        distances = hamming_distances(np.frombuffer(self.hashes, dtype=np.uint64), hash_value)
+        positions = np.flatnonzero(distances <= max_distance)
+        order = positions[np.argsort(distances[positions], kind="stable")]
+        return [(int(distances[i]), int(i), self.values[i]) for i in order]
+
+    def nearest(self, hash_value):
+        """Returns (distance, position, value) of the closest entry, or None if the index is empty."""
+        if not self.hashes:
+            return None
+        distances = hamming_distances(np.frombuffer(self.hashes, dtype=np.uint64), hash_value)
+        i = int(np.argmin(distances))
+        return int(distances[i]), i, self.values[i]
@@ -0,0 +1,102 @@
+"""
+Machine-readable step log for recorded sessions.
+
+Every agent step appends one JSON object to steps.jsonl in the session directory:
+  step            Step number within the instruction
+  frame           File name of the screenshot sent to the model
+  coord_scale     Encoded-frame to screen coordinate factors, or null
+  fingerprint     Screen fingerprint (hex hashes), or null
+  request_sha256  SHA-256 of the request body sent to the model
+  model_output    Raw model output, or null if the call failed
+  actions         Parsed actions, in order
+  plan_fingerprints  Screens checked between the actions of a plan
+  status          Step status returned by the agent
+  timings_ms      capture, inference and execute durations
+  settings        DesktopAgent.settings(): step limits, plan settings and loop detector
+                  settings the output was handled with
+  memory          DesktopAgent.memory_report() after the step, only when trace_memory is on
+
+Secrets registered with agent_logging (OTP and mobile values) are masked as
+*** in model_output and actions, the same as in session_log.jsonl.
+
+replay.py reads these files back to re-run the agent logic offline.
+"""
+
+import json
+import os
+
+import agent_logging
+
+STEP_LOG_NAME = "steps.jsonl"
+# Record fields that can contain typed text
+MASKED_FIELDS = ("model_output", "actions")
+
+
+def fingerprint_to_json(fingerprint):
+    """Converts a screen_hash.Fingerprint to a JSON-friendly dictionary of hex strings."""
+    if fingerprint is None:
+        return None
+    return {
+        "ahash": f"{fingerprint.ahash:016x}",
+        "dhash": f"{fingerprint.dhash:016x}",
+        "phash": f"{fingerprint.phash:016x}",
+        "tiles": [f"{int(tile):016x}" for tile in fingerprint.tiles],
+    }
+
+
+def fingerprint_from_json(data):
+    """Rebuilds a screen_hash.Fingerprint from fingerprint_to_json output."""
+    if not data:
+        return None
+    import numpy as np
+    import screen_hash
+
+    tiles = np.array([int(tile, 16) for tile in data["tiles"]], dtype=np.uint64)
+    return screen_hash.Fingerprint(int(data["ahash"], 16), int(data["dhash"], 16), int(data["phash"], 16), tiles)
+
+
+def _mask(value):
+    """Masks registered secrets in every string inside value."""
+    if isinstance(value, str):
+        return agent_logging.mask_secrets(value)
+    if isinstance(value, list):
+        return [_mask(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _mask(item) for key, item in value.items()}
+    return value
+
+
+def append_step(session_dir, record):
+    """Appends one step record to the session's step log, masking secrets in MASKED_FIELDS."""
+    record = dict(record)
+    for field in MASKED_FIELDS:
+        record[field] = _mask(record.get(field))
+    with open(os.path.join(session_dir, STEP_LOG_NAME), "a", encoding="utf-8") as log_file:
+        log_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def read_steps(path):
+    """Yields the step records of a steps.jsonl file, skipping lines that are not valid JSON."""
+    with open(path, encoding="utf-8") as log_file:
+        for line in log_file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # A step interrupted mid-write leaves a partial last line
+                continue
+
+
+def find_step_logs(paths):
+    """Returns the steps.jsonl files at or below each path, sorted."""
+    found = []
+    for path in paths:
+        if os.path.isfile(path):
+            found.append(path)
+            continue
+        for root, _, names in os.walk(path):
+            if STEP_LOG_NAME in names:
+                found.append(os.path.join(root, STEP_LOG_NAME))
+    return sorted(found)
@@ -0,0 +1,195 @@
+"""
+Text entry for the `type` action.
+
+Typing long text one synthetic keystroke at a time is slow and chatty, so text
+is pasted through the clipboard where possible and the previous clipboard
+contents are restored afterwards:
+  - Windows: pyperclip and ctrl+v
+  - Linux: xclip and ctrl+v, falling back to `xdotool type` with no
+    per-character delay, then to pyautogui keystrokes. Terminal emulators,
+    where ctrl+v does not paste, are typed into with xdotool.
+  - macOS: pyautogui keystrokes
+
+On Linux the clipboard is only restored once the application has actually
+read the pasted text; if nothing could be saved the clipboard is left empty
+rather than holding the typed text, which may be an OTP or a password.
+"""
+
+import logging
+import select
+import shutil
+import subprocess
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# Methods for type_text: "auto" picks the fastest one available on this platform
+METHOD_AUTO = "auto"
+METHOD_PASTE = "paste"
+METHOD_XDOTOOL = "xdotool"
+METHOD_KEYSTROKES = "keystrokes"
+
+# Whether a field is cleared (ctrl+a, backspace) before typing. A type action can
+# override this per field with clear='true' or clear='false'.
+CLEAR_ALWAYS = "always"
+CLEAR_NEVER = "never"
+DEFAULT_CLEAR_POLICY = CLEAR_ALWAYS
+
+# Time for the focused application to read the clipboard before it is restored (Windows)
+PASTE_SETTLE_DELAY = 0.1
+CLIPBOARD_TIMEOUT = 2
+# Time for the focused application to request the pasted text after ctrl+v (Linux)
+PASTE_TIMEOUT = 1.0
+
+# Substrings of X window classes of terminal emulators (xterm, gnome-terminal, konsole, ...)
+TERMINAL_WINDOW_CLASSES = ("term", "konsole", "rxvt", "alacritty", "kitty", "tilix", "wezterm", "foot", "yakuake", "guake")
+
+
+def should_clear(params, policy=None):
+    """Decides whether to clear the field first, honouring a clear='true'/'false' action parameter."""
+    clear = str(params.get("clear", "")).strip().lower()
+    if clear in ("true", "yes", "1"):
+        return True
+    if clear in ("false", "no", "0"):
+        return False
+    return (policy or DEFAULT_CLEAR_POLICY) == CLEAR_ALWAYS
+
+
+def clear_field(gui):
+    """Selects everything in the focused field and deletes it."""
+    # pyautogui already pauses after each call, so no extra sleeps are needed here
+    gui.hotkey('ctrl', 'a')
+    gui.press('backspace')
+
+
+def _read_clipboard_linux():
+    """Current clipboard contents as bytes, or None if it is empty, not text or unreadable."""
+    try:
+        result = subprocess.run(["xclip", "-selection", "clipboard", "-o"], capture_output=True, timeout=CLIPBOARD_TIMEOUT)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout if result.returncode == 0 else None
+
+
+def _wait_for_owner(owner, timeout):
+    """Waits until xclip reports that it owns the selection. Returns False if it exits or times out first."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        ready, _, _ = select.select([owner.stderr], [], [], max(0.0, deadline - time.monotonic()))
+        if not ready:
+            break
+        line = owner.stderr.readline()
+        if not line:
+            return False
+        if line.startswith(b"Waiting for"):
+            return True
+    return False
+
+
+def _active_window_is_terminal():
+    """True if the focused window looks like a terminal emulator, where ctrl+v does not paste."""
+    if not shutil.which("xdotool"):
+        return False
+    try:
+        result = subprocess.run(["xdotool", "getactivewindow", "getwindowclassname"],
+                                capture_output=True, text=True, timeout=CLIPBOARD_TIMEOUT)
+    except (OSError, subprocess.SubprocessError):
+        return False
+    window_class = result.stdout.strip().lower()
+    return result.returncode == 0 and any(name in window_class for name in TERMINAL_WINDOW_CLASSES)
+
+
+def _paste_linux(gui, text):
+    """
+    Pastes text with xclip and ctrl+v. xclip serves exactly one paste request (-l 1) and then
+    exits, so its exit confirms the application has read the text before the previous
+    clipboard is restored. Returns False, with nothing left on the clipboard, if the
+    paste was not picked up in time; the caller then types the text instead.
+    """
+    if not shutil.which("xclip"):
+        return False
+
+    previous = _read_clipboard_linux()
+    try:
+        owner = subprocess.Popen(["xclip", "-selection", "clipboard", "-i", "-verbose", "-l", "1"],
+                                 stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except OSError as e:
+        logger.warning(f"Clipboard paste unavailable: {e}")
+        return False
+
+    pasted = False
+    try:
+        owner.stdin.write(text.encode("utf-8"))
+        owner.stdin.close()
+        if _wait_for_owner(owner, CLIPBOARD_TIMEOUT):
+            gui.hotkey('ctrl', 'v')
+            try:
+                owner.wait(timeout=PASTE_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                pass
+            pasted = owner.returncode == 0
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"Clipboard paste failed: {e}")
+    finally:
+        # Once xclip is gone nothing owns the clipboard, so the text does not linger there
+        if owner.poll() is None:
+            owner.kill()
+            owner.wait()
+        owner.stderr.close()
+
+    if not pasted:
+        logger.warning("Paste was not picked up by the focused window; typing instead.")
+    if previous is not None:
+        try:
+            subprocess.run(["xclip", "-selection", "clipboard", "-i"], input=previous, timeout=CLIPBOARD_TIMEOUT)
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning(f"Could not restore clipboard: {e}")
+    return pasted
+
+
+def _paste_windows(gui, text):
+    import pyperclip
+
+    original_clipboard = pyperclip.paste()
+    pyperclip.copy(text)
+    gui.hotkey('ctrl', 'v')
+    time.sleep(PASTE_SETTLE_DELAY)
+    pyperclip.copy(original_clipboard)
+    return True
+
+
+def _type_xdotool(text):
+    if not shutil.which("xdotool"):
+        return False
+    try:
+        subprocess.run(["xdotool", "type", "--delay", "0", "--clearmodifiers", "--", text],
+                       check=True, timeout=max(CLIPBOARD_TIMEOUT, len(text) / 100))
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"xdotool typing failed: {e}")
+        return False
+    return True
+
+
+def type_text(gui, text, method=METHOD_AUTO):
+    """
+    Enters text into the focused field and returns the method that was used.
+    Falls back to plain keystrokes when the requested method is unavailable.
+    """
+    if not text:
+        return None
+
+    if method in (METHOD_AUTO, METHOD_PASTE):
+        if sys.platform == "win32" and _paste_windows(gui, text):
+            return METHOD_PASTE
+        if sys.platform.startswith("linux"):
+            # Explicit paste is honoured; auto mode types into terminals instead
+            if (method == METHOD_PASTE or not _active_window_is_terminal()) and _paste_linux(gui, text):
+                return METHOD_PASTE
+
+    if method in (METHOD_AUTO, METHOD_XDOTOOL) and sys.platform.startswith("linux"):
+        if _type_xdotool(text):
+            return METHOD_XDOTOOL
+
+    gui.write(text, interval=0)
+    return METHOD_KEYSTROKES